@@ -8,8 +8,7 @@ import os
 import capnp
 import time
 
-from typing import Optional, List, Union, Dict, Deque
-from collections import deque
+from typing import Optional, List, Union, Dict
 
 from cereal import log
 from cereal.services import SERVICE_LIST
@@ -87,6 +86,43 @@ def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
       return log_from_bytes(dat)
 
 
+class FrequencyTracker:
+  """Receive intervals in a fixed-size ring, with running sums over the whole ring and its newest
+  tenth so the average frequencies are updated in O(1) per message."""
+  def __init__(self, maxlen: int):
+    self.dts = [0.] * maxlen
+    self.maxlen = maxlen
+    self.recent_len = max(int(maxlen / 10), 1)
+    self.count = 0
+    self.total = 0.
+    self.recent_total = 0.
+
+  def add(self, dt: float) -> None:
+    idx = self.count % self.maxlen
+    if self.count >= self.maxlen:
+      self.total -= self.dts[idx]
+    if self.count >= self.recent_len:
+      self.recent_total -= self.dts[(self.count - self.recent_len) % self.maxlen]
+
+    self.dts[idx] = dt
+    self.total += dt
+    self.recent_total += dt
+    self.count += 1
+
+    # resum once per lap so floating point error can't accumulate
+    if idx == self.maxlen - 1:
+      self.total = sum(self.dts)
+      self.recent_total = sum(self.dts[self.maxlen - self.recent_len:])
+
+  def avg_freq(self) -> float:
+    n = min(self.count, self.maxlen)
+    return n / self.total if n and self.total > 0 else 0.
+
+  def recent_avg_freq(self) -> float:
+    n = min(self.count, self.recent_len)
+    return n / self.recent_total if n and self.recent_total > 0 else 0.
+
+
 class SubMaster:
   def __init__(self, services: List[str], poll: Optional[str] = None,
                ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
@@ -98,7 +134,9 @@ class SubMaster:
     self.recv_frame = {s: 0 for s in services}
     self.alive = {s: False for s in services}
     self.freq_ok = {s: False for s in services}
-    self.recv_dts: Dict[str, Deque[float]] = {}
+    self.freq_tracker: Dict[str, FrequencyTracker] = {}
+    self.alive_timeout: Dict[str, float] = {}
+    self.updated_services: List[str] = []
     self.sock = {}
     self.data = {}
     self.valid = {}
@@ -148,7 +186,11 @@ class SubMaster:
           min_freq = min(freq, freq / 2.)
       self.max_freq[s] = max_freq*1.2
       self.min_freq[s] = min_freq*0.8
-      self.recv_dts[s] = deque(maxlen=int(10*freq))
+      self.freq_tracker[s] = FrequencyTracker(int(10*freq))
+
+      if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation:
+        # alive if delay is within 10x the expected frequency
+        self.alive_timeout[s] = 10. / SERVICE_LIST[s].frequency
 
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
     return self.data[s]
@@ -168,7 +210,17 @@ class SubMaster:
 
   def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
     self.frame += 1
-    self.updated = dict.fromkeys(self.updated, False)
+    for s in self.updated_services:
+      self.updated[s] = False
+    self.updated_services.clear()
+
+    if self.frame == 0:
+      for s in self.data:
+        if s not in self.alive_timeout:
+          self.freq_ok[s] = True
+          # alive is defined as seen when simulation flag set
+          self.alive[s] = self.seen[s] if self.simulation else True
+
     for msg in msgs:
       if msg is None:
         continue
@@ -176,40 +228,28 @@ class SubMaster:
       s = msg.which()
       self.seen[s] = True
       self.updated[s] = True
+      self.updated_services.append(s)
 
       if self.recv_time[s] > 1e-5:
-        self.recv_dts[s].append(cur_time - self.recv_time[s])
+        tracker = self.freq_tracker[s]
+        tracker.add(cur_time - self.recv_time[s])
+
+        # check average frequency; slow to fall, quick to recover
+        if s in self.alive_timeout:
+          avg_freq_ok = self.min_freq[s] <= tracker.avg_freq() <= self.max_freq[s]
+          recent_freq_ok = self.min_freq[s] <= tracker.recent_avg_freq() <= self.max_freq[s]
+          self.freq_ok[s] = avg_freq_ok or recent_freq_ok
       self.recv_time[s] = cur_time
       self.recv_frame[s] = self.frame
       self.data[s] = getattr(msg, s)
       self.logMonoTime[s] = msg.logMonoTime
       self.valid[s] = msg.valid
 
-    for s in self.data:
-      if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation:
-        # alive if delay is within 10x the expected frequency
-        self.alive[s] = (cur_time - self.recv_time[s]) < (10. / SERVICE_LIST[s].frequency)
+      if self.simulation:
+        self.alive[s] = True
 
-        # check average frequency; slow to fall, quick to recover
-        dts = self.recv_dts[s]
-        assert dts.maxlen is not None
-        recent_dts = list(dts)[-int(dts.maxlen / 10):]
-        try:
-          avg_freq = 1 / (sum(dts) / len(dts))
-          avg_freq_recent = 1 / (sum(recent_dts) / len(recent_dts))
-        except ZeroDivisionError:
-          avg_freq = 0
-          avg_freq_recent = 0
-
-        avg_freq_ok = self.min_freq[s] <= avg_freq <= self.max_freq[s]
-        recent_freq_ok = self.min_freq[s] <= avg_freq_recent <= self.max_freq[s]
-        self.freq_ok[s] = avg_freq_ok or recent_freq_ok
-      else:
-        self.freq_ok[s] = True
-        if self.simulation:
-          self.alive[s] = self.seen[s] # alive is defined as seen when simulation flag set
-        else:
-          self.alive[s] = True
+    for s, timeout in self.alive_timeout.items():
+      self.alive[s] = (cur_time - self.recv_time[s]) < timeout
 
   def all_alive(self, service_list: Optional[List[str]] = None) -> bool:
     if service_list is None:
@@ -0,0 +1,101 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+from typing import NamedTuple
+
+# flags from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+READ_SIZE = 64 * 1024
+
+
+class InotifyEvent(NamedTuple):
+  path: str | None  # watched path the event happened in, None for IN_Q_OVERFLOW
+  mask: int
+  cookie: int
+  name: str  # entry name inside the watched directory, empty for the directory itself
+
+
+class Inotify:
+  """Thin non-blocking wrapper around the Linux inotify syscalls, raises OSError where they aren't available."""
+  def __init__(self):
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    try:
+      self._inotify_add_watch = libc.inotify_add_watch
+      self._inotify_rm_watch = libc.inotify_rm_watch
+      inotify_init1 = libc.inotify_init1
+    except AttributeError as e:
+      raise OSError("inotify is not supported on this platform") from e
+
+    self._inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    self._inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+    self.fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+
+    self.watches: dict[int, str] = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def fileno(self) -> int:
+    return self.fd
+
+  def close(self) -> None:
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+    self.watches.clear()
+
+  def add_watch(self, path: str, mask: int) -> int:
+    wd = self._inotify_add_watch(self.fd, os.fsencode(path), mask)
+    if wd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err), path)
+    self.watches[wd] = path
+    return wd
+
+  def rm_watch(self, wd: int) -> None:
+    # the kernel drops watches of deleted paths on its own, so failures here are expected
+    if self.watches.pop(wd, None) is not None:
+      self._inotify_rm_watch(self.fd, wd)
+
+  def read(self) -> list[InotifyEvent]:
+    """Drains all pending events without blocking."""
+    events = []
+    while True:
+      try:
+        buf = os.read(self.fd, READ_SIZE)
+      except BlockingIOError:
+        return events
+
+      offset = 0
+      while offset < len(buf):
+        wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+        offset += EVENT_HEADER.size
+        name = os.fsdecode(buf[offset:offset + length].rstrip(b"\0"))
+        offset += length
+
+        path = self.watches.get(wd)
+        if mask & IN_IGNORED:
+          self.watches.pop(wd, None)
+        events.append(InotifyEvent(path, mask, cookie, name))
@@ -26,68 +26,76 @@ logging.basicConfig(level=LOGLEVEL, format='%(message)s')
 CANPACKET_HEAD_SIZE = 0x6
 DLC_TO_LEN = [0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64]
 LEN_TO_DLC = {length: dlc for (dlc, length) in enumerate(DLC_TO_LEN)}
+CANPACKET_HEAD = struct.Struct("<BIB")  # DLC and bus, address and flags, checksum
 PANDA_BUS_CNT = 4
 
 
 def calculate_checksum(data):
-  res = 0
-  for b in data:
-    res ^= b
-  return res
+  # XOR of all bytes, folding the halves of the data as one big integer instead of looping over bytes
+  res = int.from_bytes(data, "little")
+  width = 8
+  while width < len(data) * 8:
+    width *= 2
+  while width > 8:
+    width //= 2
+    res ^= res >> width
+  return res & 0xFF
 
 def pack_can_buffer(arr):
-  snds = [b'']
+  snds = []
+  chunk = []
+  chunk_len = 0
   for address, _, dat, bus in arr:
     assert len(dat) in LEN_TO_DLC
     #logging.debug("  W 0x%x: 0x%s", address, dat.hex())
 
     extended = 1 if address >= 0x800 else 0
-    data_len_code = LEN_TO_DLC[len(dat)]
-    header = bytearray(CANPACKET_HEAD_SIZE)
+    byte_0 = (LEN_TO_DLC[len(dat)] << 4) | (bus << 1)
     word_4b = address << 3 | extended << 2
-    header[0] = (data_len_code << 4) | (bus << 1)
-    header[1] = word_4b & 0xFF
-    header[2] = (word_4b >> 8) & 0xFF
-    header[3] = (word_4b >> 16) & 0xFF
-    header[4] = (word_4b >> 24) & 0xFF
-    header[5] = calculate_checksum(header[:5] + dat)
-
-    snds[-1] += header + dat
-    if len(snds[-1]) > 256: # Limit chunks to 256 bytes
-      snds.append(b'')
-
+    checksum = word_4b ^ (word_4b >> 16)
+    checksum = (checksum ^ (checksum >> 8) ^ byte_0 ^ calculate_checksum(dat)) & 0xFF
+
+    chunk.append(CANPACKET_HEAD.pack(byte_0, word_4b, checksum))
+    chunk.append(dat)
+    chunk_len += CANPACKET_HEAD_SIZE + len(dat)
+    if chunk_len > 256: # Limit chunks to 256 bytes
+      snds.append(b''.join(chunk))
+      chunk = []
+      chunk_len = 0
+
+  snds.append(b''.join(chunk))
   return snds
 
 def unpack_can_buffer(dat):
   ret = []
 
-  while len(dat) >= CANPACKET_HEAD_SIZE:
-    data_len = DLC_TO_LEN[(dat[0]>>4)]
+  # walk the buffer by offset, slicing off the consumed packets only once at the end
+  offset = 0
+  while len(dat) - offset >= CANPACKET_HEAD_SIZE:
+    byte_0, word_4b, _ = CANPACKET_HEAD.unpack_from(dat, offset)
+    data_len = DLC_TO_LEN[(byte_0>>4)]
 
-    header = dat[:CANPACKET_HEAD_SIZE]
+    bus = (byte_0 >> 1) & 0x7
+    address = word_4b >> 3
 
-    bus = (header[0] >> 1) & 0x7
-    address = (header[4] << 24 | header[3] << 16 | header[2] << 8 | header[1]) >> 3
-
-    if (header[1] >> 1) & 0x1:
+    if (word_4b >> 1) & 0x1:
       # returned
       bus += 128
-    if header[1] & 0x1:
+    if word_4b & 0x1:
       # rejected
       bus += 192
 
     # we need more from the next transfer
-    if data_len > len(dat) - CANPACKET_HEAD_SIZE:
+    if data_len > len(dat) - offset - CANPACKET_HEAD_SIZE:
       break
 
-    assert calculate_checksum(dat[:(CANPACKET_HEAD_SIZE+data_len)]) == 0, "CAN packet checksum incorrect"
-
-    data = dat[CANPACKET_HEAD_SIZE:(CANPACKET_HEAD_SIZE+data_len)]
-    dat = dat[(CANPACKET_HEAD_SIZE+data_len):]
+    end = offset + CANPACKET_HEAD_SIZE + data_len
+    assert calculate_checksum(dat[offset:end]) == 0, "CAN packet checksum incorrect"
 
-    ret.append((address, 0, data, bus))
+    ret.append((address, 0, dat[offset+CANPACKET_HEAD_SIZE:end], bus))
+    offset = end
 
-  return (ret, dat)
+  return (ret, dat[offset:])
 
 
 def ensure_version(desc, lib_field, panda_field, fn):
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import bisect
+import capnp
 import math
 import os
 from enum import IntEnum
@@ -49,62 +49,102 @@ EVENT_NAME = {v: k for k, v in EventName.schema.enumerants.items()}
 
 
 class Events:
+  """
+  Set of the currently active events, kept as a bitmask of event names.
+
+  Adding, clearing and checking for an event type are bit operations, the sorted name list is only
+  rebuilt when the set changed, and creation delay counters are only kept for active events.
+  """
   def __init__(self):
-    self.events: list[int] = []
-    self.static_events: list[int] = []
-    self.event_counters = dict.fromkeys(EVENTS.keys(), 0)
+    self.mask = 0
+    self.static_mask = 0
+    self.event_counters: dict[int, int] = {}  # consecutive frames each active event has been active for
+
+    self._names: list[int] = []
+    self._names_mask = 0
 
   @property
   def names(self) -> list[int]:
-    return self.events
+    if self._names_mask != self.mask:
+      self._names = mask_to_names(self.mask)
+      self._names_mask = self.mask
+    return self._names
 
   def __len__(self) -> int:
-    return len(self.events)
+    return self.mask.bit_count()
 
   def add(self, event_name: int, static: bool=False) -> None:
     if static:
-      bisect.insort(self.static_events, event_name)
-    bisect.insort(self.events, event_name)
+      self.static_mask |= 1 << event_name
+    self.mask |= 1 << event_name
 
   def clear(self) -> None:
-    self.event_counters = {k: (v + 1 if k in self.events else 0) for k, v in self.event_counters.items()}
-    self.events = self.static_events.copy()
+    self.event_counters = {e: self.event_counters.get(e, 0) + 1 for e in self.names}
+    self.mask = self.static_mask
 
   def contains(self, event_type: str) -> bool:
-    return any(event_type in EVENTS.get(e, {}) for e in self.events)
+    return self.mask & EVENT_TYPE_MASKS.get(event_type, 0) != 0
 
   def create_alerts(self, event_types: list[str], callback_args=None):
     if callback_args is None:
       callback_args = []
 
     ret = []
-    for e in self.events:
-      types = EVENTS[e].keys()
+    if not any(self.mask & EVENT_TYPE_MASKS.get(et, 0) for et in event_types):
+      return ret
+
+    for e in self.names:
+      alerts = EVENTS.get(e, {})
       for et in event_types:
-        if et in types:
-          alert = EVENTS[e][et]
+        if et in alerts:
+          alert = alerts[et]
           if not isinstance(alert, Alert):
             alert = alert(*callback_args)
 
-          if DT_CTRL * (self.event_counters[e] + 1) >= alert.creation_delay:
-            alert.alert_type = f"{EVENT_NAME[e]}/{et}"
+          if DT_CTRL * (self.event_counters.get(e, 0) + 1) >= alert.creation_delay:
+            alert.alert_type = alert_type_name(e, et)
             alert.event_type = et
             ret.append(alert)
     return ret
 
   def add_from_msg(self, events):
     for e in events:
-      bisect.insort(self.events, e.name.raw)
+      self.mask |= 1 << e.name.raw
 
   def to_msg(self):
-    ret = []
-    for event_name in self.events:
-      event = car.CarEvent.new_message()
-      event.name = event_name
-      for event_type in EVENTS.get(event_name, {}):
-        setattr(event, event_type, True)
-      ret.append(event)
-    return ret
+    return [car_event(event_name) for event_name in self.names]
+
+
+def mask_to_names(mask: int) -> list[int]:
+  names = []
+  while mask:
+    lowest = mask & -mask
+    names.append(lowest.bit_length() - 1)
+    mask ^= lowest
+  return names
+
+
+# events never change their types, so their CarEvent messages and alert type names are built once
+_car_events: dict[int, capnp.lib.capnp._DynamicStructBuilder] = {}
+_alert_type_names: dict[tuple[int, str], str] = {}
+
+
+def car_event(event_name: int) -> capnp.lib.capnp._DynamicStructBuilder:
+  event = _car_events.get(event_name)
+  if event is None:
+    event = car.CarEvent.new_message()
+    event.name = event_name
+    for event_type in EVENTS.get(event_name, {}):
+      setattr(event, event_type, True)
+    _car_events[event_name] = event
+  return event
+
+
+def alert_type_name(event_name: int, event_type: str) -> str:
+  name = _alert_type_names.get((event_name, event_type))
+  if name is None:
+    name = _alert_type_names[(event_name, event_type)] = f"{EVENT_NAME[event_name]}/{event_type}"
+  return name
 
 
 class Alert:
@@ -1210,6 +1250,10 @@ EVENTS: dict[int, dict[str, Alert | AlertCallbackType]] = {
 }
 
 
+# bitmask of the events that have an alert of each event type
+EVENT_TYPE_MASKS: dict[str, int] = {event_type: sum(1 << event_name for event_name, alerts in EVENTS.items() if event_type in alerts)
+                                    for event_type in {event_type for alerts in EVENTS.values() for event_type in alerts}}
+
 if __name__ == '__main__':
   # print all alerts by type and priority
   from cereal.services import SERVICE_LIST
@@ -55,6 +55,9 @@ T_IDXS_LST = [index_function(idx, max_val=MAX_T, max_idx=N) for idx in range(N+1
 T_IDXS = np.array(T_IDXS_LST)
 FCW_IDXS = T_IDXS < 5.0
 T_DIFFS = np.diff(T_IDXS, prepend=[0.])
+T_IDXS_SQ_HALF = T_IDXS**2 / 2.
+# yref of all stages back to back, the terminal stage only takes the first COST_E_DIM values
+YREF_FLAT_DIM = N * COST_DIM + COST_E_DIM
 COMFORT_BRAKE = 2.5
 STOP_DISTANCE = 6.0
 
@@ -248,7 +251,11 @@ class LongitudinalMpc:
   def __init__(self, mode='acc', dt=DT_MDL):
     self.mode = mode
     self.dt = dt
+    self.t_idxs_next = T_IDXS + dt
+    self.x_obstacles = np.zeros((N+1, 3))
     self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    # prebuilt releases can ship a solver module compiled before set_flat/get_flat existed
+    self.bulk_solver = hasattr(self.solver, 'set_flat') and hasattr(self.solver, 'get_flat')
     self.reset()
     self.source = SOURCES[2]
 
@@ -261,14 +268,11 @@ class LongitudinalMpc:
     self.prev_a = np.array(self.a_solution)
     self.j_solution = np.zeros(N)
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    self.set_solver_yref()
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N,1))
     self.params = np.zeros((N+1, PARAM_DIM))
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
+    self.set_solver_x(self.x_sol)
     self.last_cloudlog_t = 0
     self.status = False
     self.crash_cnt = 0.0
@@ -281,6 +285,38 @@ class LongitudinalMpc:
     self.x0 = np.zeros(X_DIM)
     self.set_weights()
 
+  def set_solver_yref(self):
+    if self.bulk_solver:
+      self.solver.set_flat("yref", self.yref.reshape(-1)[:YREF_FLAT_DIM])
+    else:
+      for i in range(N):
+        self.solver.set(i, "yref", self.yref[i])
+      self.solver.set(N, "yref", self.yref[N][:COST_E_DIM])
+
+  def set_solver_x(self, x):
+    if self.bulk_solver:
+      self.solver.set_flat('x', x)
+    else:
+      for i in range(N+1):
+        self.solver.set(i, 'x', x[i])
+
+  def set_solver_params(self):
+    if self.bulk_solver:
+      self.solver.set_flat('p', self.params)
+    else:
+      for i in range(N+1):
+        self.solver.set(i, 'p', self.params[i])
+
+  def get_solver_solution(self):
+    if self.bulk_solver:
+      self.solver.get_flat('x', self.x_sol)
+      self.solver.get_flat('u', self.u_sol)
+    else:
+      for i in range(N+1):
+        self.x_sol[i] = self.solver.get(i, 'x')
+      for i in range(N):
+        self.u_sol[i] = self.solver.get(i, 'u')
+
   def set_cost_weights(self, cost_weights, constraint_cost_weights):
     W = np.asfortranarray(np.diag(cost_weights))
     for i in range(N):
@@ -315,12 +351,11 @@ class LongitudinalMpc:
     self.x0[1] = v
     self.x0[2] = a
     if abs(v_prev - v) > 2.:  # probably only helps if v < v_prev
-      for i in range(N+1):
-        self.solver.set(i, 'x', self.x0)
+      self.set_solver_x(np.tile(self.x0, (N+1, 1)))
 
   @staticmethod
   def extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau):
-    a_lead_traj = a_lead * np.exp(-a_lead_tau * (T_IDXS**2)/2.)
+    a_lead_traj = a_lead * np.exp(-a_lead_tau * T_IDXS_SQ_HALF)
     v_lead_traj = np.clip(v_lead + np.cumsum(T_DIFFS * a_lead_traj), 0.0, 1e8)
     x_lead_traj = x_lead + np.cumsum(T_DIFFS * v_lead_traj)
     lead_xv = np.column_stack((x_lead_traj, v_lead_traj))
@@ -380,11 +415,11 @@ class LongitudinalMpc:
       # when the leads are no factor.
       v_lower = v_ego + (T_IDXS * self.cruise_min_a * 1.05)
       v_upper = v_ego + (T_IDXS * self.max_a * 1.05)
-      v_cruise_clipped = np.clip(v_cruise * np.ones(N+1),
-                                 v_lower,
-                                 v_upper)
-      cruise_obstacle = np.cumsum(T_DIFFS * v_cruise_clipped) + get_safe_obstacle_distance(v_cruise_clipped, t_follow)
-      x_obstacles = np.column_stack([lead_0_obstacle, lead_1_obstacle, cruise_obstacle])
+      v_cruise_clipped = np.clip(v_cruise, v_lower, v_upper)
+      x_obstacles = self.x_obstacles
+      x_obstacles[:,0] = lead_0_obstacle
+      x_obstacles[:,1] = lead_1_obstacle
+      x_obstacles[:,2] = np.cumsum(T_DIFFS * v_cruise_clipped) + get_safe_obstacle_distance(v_cruise_clipped, t_follow)
       self.source = SOURCES[np.argmin(x_obstacles[0])]
 
       # These are not used in ACC mode
@@ -393,8 +428,9 @@ class LongitudinalMpc:
     elif self.mode == 'blended':
       self.params[:,5] = 1.0
 
-      x_obstacles = np.column_stack([lead_0_obstacle,
-                                     lead_1_obstacle])
+      x_obstacles = self.x_obstacles[:,:2]
+      x_obstacles[:,0] = lead_0_obstacle
+      x_obstacles[:,1] = lead_1_obstacle
       cruise_target = T_IDXS * np.clip(v_cruise, v_ego - 2.0, 1e3) + x[0]
       xforward = ((v[1:] + v[:-1]) / 2) * (T_IDXS[1:] - T_IDXS[:-1])
       x = np.cumsum(np.insert(xforward, 0, x[0]))
@@ -411,12 +447,10 @@ class LongitudinalMpc:
     self.yref[:,2] = v
     self.yref[:,3] = a
     self.yref[:,5] = j
-    for i in range(N):
-      self.solver.set(i, "yref", self.yref[i])
-    self.solver.set(N, "yref", self.yref[N][:COST_E_DIM])
+    self.set_solver_yref()
 
     self.params[:,2] = np.min(x_obstacles, axis=1)
-    self.params[:,3] = np.copy(self.prev_a)
+    self.params[:,3] = self.prev_a
     self.params[:,4] = t_follow
 
     self.run()
@@ -438,8 +472,7 @@ class LongitudinalMpc:
   def run(self):
     # t0 = time.monotonic()
     # reset = 0
-    for i in range(N+1):
-      self.solver.set(i, 'p', self.params[i])
+    self.set_solver_params()
     self.solver.constraints_set(0, "lbx", self.x0)
     self.solver.constraints_set(0, "ubx", self.x0)
 
@@ -456,16 +489,13 @@ class LongitudinalMpc:
     # print(f"long_mpc residuals: {res[0]:.2e}, {res[1]:.2e}, {res[2]:.2e}, {res[3]:.2e}")
     # self.solver.print_statistics()
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.get_solver_solution()
 
     self.v_solution = self.x_sol[:,1]
     self.a_solution = self.x_sol[:,2]
     self.j_solution = self.u_sol[:,0]
 
-    self.prev_a = np.interp(T_IDXS + self.dt, T_IDXS, self.a_solution)
+    self.prev_a = np.interp(self.t_idxs_next, T_IDXS, self.a_solution)
 
     t = time.monotonic()
     if self.solution_status != 0:
@@ -5,6 +5,7 @@ from openpilot.common.realtime import DT_MDL
 from openpilot.selfdrive.controls.controlsd import ButtonType
 from openpilot.selfdrive.controls.lib.drive_helpers import V_CRUISE_UNSET
 
+from openpilot.selfdrive.frogpilot.controls.lib.map_data import MapData
 from openpilot.selfdrive.frogpilot.controls.lib.map_turn_speed_controller import MapTurnSpeedController
 from openpilot.selfdrive.frogpilot.controls.lib.speed_limit_controller import SpeedLimitController
 from openpilot.selfdrive.frogpilot.frogpilot_variables import CRUISING_SPEED, PLANNER_TIME
@@ -17,8 +18,9 @@ class FrogPilotVCruise:
 
     self.params_memory = self.frogpilot_planner.params_memory
 
-    self.mtsc = MapTurnSpeedController()
-    self.slc = SpeedLimitController()
+    self.map_data = MapData()
+    self.mtsc = MapTurnSpeedController(self.map_data)
+    self.slc = SpeedLimitController(self.map_data)
 
     self.forcing_stop = False
     self.override_force_stop = False
@@ -58,6 +60,9 @@ class FrogPilotVCruise:
     v_ego_cluster = max(carState.vEgoCluster, v_ego)
     v_ego_diff = v_ego_cluster - v_ego
 
+    if frogpilot_toggles.map_turn_speed_controller or frogpilot_toggles.speed_limit_controller:
+      self.map_data.update()
+
     # Pfeiferj's Map Turn Speed Controller
     if frogpilot_toggles.map_turn_speed_controller and v_ego > CRUISING_SPEED and controlsState.enabled:
       mtsc_active = self.mtsc_target < v_cruise
@@ -0,0 +1,169 @@
+import json
+import math
+import numpy as np
+import os
+
+from collections import defaultdict
+
+from openpilot.common.params import Params
+
+R = 6373000.0  # approximate radius of earth in meters
+TO_RADIANS = math.pi / 180
+
+MATCH_DISTANCE = 1000  # meters - only points closer than this are considered as our location on the path
+
+MAP_PARAMS = ("LastGPSPosition", "MapSpeedLimit", "MapTargetVelocities", "NextMapSpeedLimit")
+
+# points should be in radians, b can be arrays of points
+# output is meters
+def distance_to_point(ax, ay, bx, by):
+  a = np.sin((bx - ax) / 2) * np.sin((bx - ax) / 2) + np.cos(ax) * np.cos(bx) * np.sin((by - ay) / 2) * np.sin((by - ay) / 2)
+  c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+  return R * c  # in meters
+
+class MapData:
+  """
+  Map state from mapd shared by the Speed Limit Controller and the Map Turn Speed Controller.
+
+  The params are only read and decoded when mapd or paramsd replace them, and the upcoming map points
+  are projected to local east/north coordinates and bucketed into a grid so our location on the path
+  is found without scanning every point. sequence is bumped whenever any of them changed.
+  """
+  def __init__(self):
+    self.params_memory = Params("/dev/shm/params")
+
+    # Params are written by replacing the file, so its inode and mtime tell us when it changed
+    self.param_paths = {key: self.params_memory.get_param_path(key) for key in MAP_PARAMS}
+    self.param_versions = dict.fromkeys(MAP_PARAMS)
+    self.sequence = 0
+
+    self.position_valid = False
+    self.lat = 0.0
+    self.lon = 0.0
+
+    self.map_speed_limit = 0.0
+    self.next_map_speed_limit = {}
+
+    self.target_velocities_data = None
+    self.target_velocities_valid = False
+    self.latitudes = np.zeros(0)
+    self.longitudes = np.zeros(0)
+    self.velocities = np.zeros(0)
+
+    self.origin = (0.0, 0.0)
+    self.grid = {}
+
+  def param_changed(self, key):
+    try:
+      stat = os.stat(self.param_paths[key])
+      version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+      version = None
+
+    if version == self.param_versions[key]:
+      return False
+
+    self.param_versions[key] = version
+    return True
+
+  def update(self):
+    changed = False
+
+    if self.param_changed("LastGPSPosition"):
+      changed = True
+      try:
+        position = json.loads(self.params_memory.get("LastGPSPosition"))
+        self.lat = position["latitude"]
+        self.lon = position["longitude"]
+        self.position_valid = True
+      except (TypeError, KeyError, ValueError):
+        self.lat = 0.0
+        self.lon = 0.0
+        self.position_valid = False
+
+    if self.param_changed("MapSpeedLimit"):
+      changed = True
+      map_speed_limit = self.params_memory.get("MapSpeedLimit")
+      self.map_speed_limit = float(map_speed_limit) if map_speed_limit is not None else 0.0
+
+    if self.param_changed("NextMapSpeedLimit"):
+      changed = True
+      next_map_speed_limit = self.params_memory.get("NextMapSpeedLimit")
+      self.next_map_speed_limit = json.loads(next_map_speed_limit) if next_map_speed_limit is not None else {}
+
+    if self.param_changed("MapTargetVelocities"):
+      changed = True
+      try:
+        self.update_target_velocities()
+        self.target_velocities_valid = True
+      except (TypeError, KeyError, ValueError):
+        self.target_velocities_valid = False
+
+    if changed:
+      self.sequence += 1
+
+  def update_target_velocities(self):
+    # Re-parsed and re-indexed only when the contents changed, mapd rewrites the same path regularly
+    target_velocities_data = self.params_memory.get("MapTargetVelocities")
+    if target_velocities_data == self.target_velocities_data:
+      return
+
+    target_velocities = json.loads(target_velocities_data)
+    self.latitudes = np.array([target_velocity["latitude"] for target_velocity in target_velocities], dtype=float)
+    self.longitudes = np.array([target_velocity["longitude"] for target_velocity in target_velocities], dtype=float)
+    self.velocities = np.array([target_velocity["velocity"] for target_velocity in target_velocities], dtype=float)
+
+    self.target_velocities_data = target_velocities_data
+    self.build_grid()
+
+  def to_local(self, lat, lon):
+    # Equirectangular projection around the first point, accurate enough over the few kilometers mapd sends
+    origin_lat, origin_lon = self.origin
+    east = (lon - origin_lon) * TO_RADIANS * R * math.cos(origin_lat * TO_RADIANS)
+    north = (lat - origin_lat) * TO_RADIANS * R
+    return east, north
+
+  def cell(self, east, north):
+    return (np.floor(east / MATCH_DISTANCE).astype(int), np.floor(north / MATCH_DISTANCE).astype(int))
+
+  def build_grid(self):
+    self.grid = {}
+    if len(self.latitudes) == 0:
+      return
+
+    self.origin = (self.latitudes[0], self.longitudes[0])
+    cells_east, cells_north = self.cell(*self.to_local(self.latitudes, self.longitudes))
+
+    grid = defaultdict(list)
+    for i, key in enumerate(zip(cells_east.tolist(), cells_north.tolist(), strict=True)):
+      grid[key].append(i)
+    self.grid = {key: np.array(idxs) for key, idxs in grid.items()}
+
+  def distance_to(self, lat, lon):
+    return distance_to_point(self.lat * TO_RADIANS, self.lon * TO_RADIANS, np.asarray(lat) * TO_RADIANS, np.asarray(lon) * TO_RADIANS)
+
+  def nearest_point_ahead(self, start=0):
+    """Index of the closest map point at or after start, or start if none are within MATCH_DISTANCE."""
+    if len(self.grid) == 0:
+      return start
+
+    # Points within MATCH_DISTANCE can only be in our cell or the eight around it
+    cell_east, cell_north = map(int, self.cell(*self.to_local(self.lat, self.lon)))
+    candidates = [self.grid[key] for key in ((cell_east + i, cell_north + j) for i in (-1, 0, 1) for j in (-1, 0, 1)) if key in self.grid]
+    if len(candidates) == 0:
+      return start
+
+    candidates = np.sort(np.concatenate(candidates))
+    candidates = candidates[candidates >= start]
+    if len(candidates) == 0:
+      return start
+
+    distances = self.distance_to(self.latitudes[candidates], self.longitudes[candidates])
+    nearest = np.argmin(distances)
+    return int(candidates[nearest]) if distances[nearest] < MATCH_DISTANCE else start
+
+  def points_ahead(self, start=0):
+    """Latitudes, longitudes, target velocities and distances of the map points from start onwards."""
+    latitudes = self.latitudes[start:]
+    longitudes = self.longitudes[start:]
+    return latitudes, longitudes, self.velocities[start:], self.distance_to(latitudes, longitudes)
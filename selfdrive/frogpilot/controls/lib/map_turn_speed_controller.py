@@ -1,15 +1,9 @@
 # PFEIFER - MTSC - Modified by FrogAi for FrogPilot
-import json
-import math
+import numpy as np
 
 from openpilot.common.conversions import Conversions as CV
 from openpilot.common.numpy_fast import interp
-from openpilot.common.params import Params
 
-params_memory = Params("/dev/shm/params")
-
-R = 6373000.0 # approximate radius of earth in meters
-TO_RADIANS = math.pi / 180
 TARGET_JERK = -0.6   # m/s^3 should match up with the long planner
 TARGET_ACCEL = -1.2  # m/s^2 should match up with the long planner
 TARGET_OFFSET = 1.0  # seconds - This controls how soon before the curve you reach the target velocity. It also helps
@@ -26,117 +20,78 @@ def calculate_distance(t, target_jerk, a_ego, v_ego):
   return t * v_ego + a_ego/2 * (t ** 2) + target_jerk/6 * (t ** 3)
 
 
-# points should be in radians
-# output is meters
-def distance_to_point(ax, ay, bx, by):
-  a = math.sin((bx-ax)/2)*math.sin((bx-ax)/2) + math.cos(ax) * math.cos(bx)*math.sin((by-ay)/2)*math.sin((by-ay)/2)
-  c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-  return R * c  # in meters
-
 class MapTurnSpeedController:
-  def __init__(self):
+  def __init__(self, map_data):
+    self.map_data = map_data
+
     self.target_lat = 0.0
     self.target_lon = 0.0
     self.target_v = 0.0
 
+    # Index of the last matched point, the search continues from there since we only move forward along the path
+    self.search_start = 0
+    self.map_sequence = -1
+    self.target_velocities_data = None
+
   def target_speed(self, v_ego, a_ego, frogpilot_toggles) -> float:
-    lat = 0.0
-    lon = 0.0
-    try:
-      position = json.loads(params_memory.get("LastGPSPosition"))
-      lat = position["latitude"]
-      lon = position["longitude"]
-    except: return 0.0
-
-    try:
-      target_velocities = json.loads(params_memory.get("MapTargetVelocities"))
-    except: return 0.0
-
-    min_dist = 1000
-    min_idx = 0
-    distances = []
-
-    # find our location in the path
-    for i in range(len(target_velocities)):
-      target_velocity = target_velocities[i]
-      tlat = target_velocity["latitude"]
-      tlon = target_velocity["longitude"]
-      d = distance_to_point(lat * TO_RADIANS, lon * TO_RADIANS, tlat * TO_RADIANS, tlon * TO_RADIANS)
-      distances.append(d)
-      if d < min_dist:
-        min_dist = d
-        min_idx = i
-
-    # only look at values from our current position forward
-    forward_points = target_velocities[min_idx:]
-    forward_distances = distances[min_idx:]
+    if not (self.map_data.position_valid and self.map_data.target_velocities_valid):
+      return 0.0
+
+    if self.map_data.target_velocities_data != self.target_velocities_data:
+      self.target_velocities_data = self.map_data.target_velocities_data
+      self.search_start = 0
+
+    # find our location in the path and only look at values from our current position forward
+    if self.map_data.sequence != self.map_sequence:
+      self.map_sequence = self.map_data.sequence
+      self.search_start = self.map_data.nearest_point_ahead(self.search_start)
+    forward_lats, forward_lons, forward_velocities, forward_distances = self.map_data.points_ahead(self.search_start)
+
+    a_diff = (a_ego - TARGET_ACCEL)
+    accel_t = abs(a_diff / TARGET_JERK)
+    min_accel_v = calculate_velocity(accel_t, TARGET_JERK, a_ego, v_ego) / frogpilot_toggles.turn_aggressiveness
+
+    # calculate time needed based on target jerk
+    a = 0.5 * TARGET_JERK
+    b = a_ego
+    c = v_ego - forward_velocities
+    discriminant = b**2 - 4 * a * c
+    sqrt_discriminant = np.sqrt(np.maximum(discriminant, 0))
+    t_a = -1 * (sqrt_discriminant + b) / 2 * a
+    t_b = (sqrt_discriminant - b) / 2 * a
+    t = np.where(t_a > 0, t_a, t_b)
+    jerk_d = calculate_distance(t, TARGET_JERK, a_ego, v_ego)
+
+    # calculate additional time needed based on target accel
+    accel_d = calculate_distance(accel_t, TARGET_JERK, a_ego, v_ego)
+    accel_d += calculate_distance(np.abs((min_accel_v - forward_velocities) / TARGET_ACCEL), 0, TARGET_ACCEL, min_accel_v)
+
+    max_d = np.where(forward_velocities > min_accel_v, jerk_d, accel_d)
 
     # find velocities that we are within the distance we need to adjust for
-    valid_velocities = []
-    for i in range(len(forward_points)):
-      target_velocity = forward_points[i]
-      tlat = target_velocity["latitude"]
-      tlon = target_velocity["longitude"]
-      tv = target_velocity["velocity"]
-      if tv > v_ego:
-        continue
-
-      d = forward_distances[i]
-
-      a_diff = (a_ego - TARGET_ACCEL)
-      accel_t = abs(a_diff / TARGET_JERK)
-      min_accel_v = calculate_velocity(accel_t, TARGET_JERK, a_ego, v_ego) / frogpilot_toggles.turn_aggressiveness
-
-      max_d = 0
-      if tv > min_accel_v:
-        # calculate time needed based on target jerk
-        a = 0.5 * TARGET_JERK
-        b = a_ego
-        c = v_ego - tv
-        t_a = -1 * ((b**2 - 4 * a * c) ** 0.5 + b) / 2 * a
-        t_b = ((b**2 - 4 * a * c) ** 0.5 - b) / 2 * a
-        if not isinstance(t_a, complex) and t_a > 0:
-          t = t_a
-        else:
-          t = t_b
-        if isinstance(t, complex):
-          continue
-
-        max_d = max_d + calculate_distance(t, TARGET_JERK, a_ego, v_ego)
-
-      else:
-        t = accel_t
-        max_d = calculate_distance(t, TARGET_JERK, a_ego, v_ego)
-
-        # calculate additional time needed based on target accel
-        t = abs((min_accel_v - tv) / TARGET_ACCEL)
-        max_d += calculate_distance(t, 0, TARGET_ACCEL, min_accel_v)
-
-      if d < (max_d + tv * TARGET_OFFSET) * frogpilot_toggles.curve_sensitivity:
-        valid_velocities.append((float(tv), tlat, tlon))
+    valid = forward_velocities <= v_ego
+    valid &= (forward_velocities <= min_accel_v) | (discriminant >= 0)
+    valid &= forward_distances < (max_d + forward_velocities * TARGET_OFFSET) * frogpilot_toggles.curve_sensitivity
 
     # Find the smallest velocity we need to adjust for
     min_v = 100.0
     target_lat = 0.0
     target_lon = 0.0
-    for tv, lat, lon in valid_velocities:
-      if tv < min_v:
-        min_v = tv
-        target_lat = lat
-        target_lon = lon
+    if valid.any():
+      valid_idxs = np.flatnonzero(valid)
+      target_idx = valid_idxs[np.argmin(forward_velocities[valid_idxs])]
+      if forward_velocities[target_idx] < min_v:
+        min_v = float(forward_velocities[target_idx])
+        target_lat = float(forward_lats[target_idx])
+        target_lon = float(forward_lons[target_idx])
 
     if self.target_v < min_v and not (self.target_lat == 0 and self.target_lon == 0):
-      for i in range(len(forward_points)):
-        target_velocity = forward_points[i]
-        tlat = target_velocity["latitude"]
-        tlon = target_velocity["longitude"]
-        tv = target_velocity["velocity"]
-        if tv > v_ego:
-          continue
-
-        if tlat == self.target_lat and tlon == self.target_lon and tv == self.target_v:
-          return float(self.target_v)
+      previous_target = forward_velocities <= v_ego
+      previous_target &= forward_lats == self.target_lat
+      previous_target &= forward_lons == self.target_lon
+      previous_target &= forward_velocities == self.target_v
+      if previous_target.any():
+        return float(self.target_v)
       # not found so lets reset
       self.target_v = 0.0
       self.target_lat = 0.0
@@ -1,29 +1,17 @@
 # PFEIFER - SLC - Modified by FrogAi for FrogPilot
-import json
-import math
-
 from openpilot.common.conversions import Conversions as CV
 from openpilot.common.params import Params
 
 from openpilot.selfdrive.frogpilot.frogpilot_variables import FrogPilotVariables
 
-R = 6373000.0  # approximate radius of earth in meters
-TO_RADIANS = math.pi / 180
-
-# points should be in radians
-# output is meters
-def distance_to_point(ax, ay, bx, by):
-  a = math.sin((bx - ax) / 2) * math.sin((bx - ax) / 2) + math.cos(ax) * math.cos(bx) * math.sin((by - ay) / 2) * math.sin((by - ay) / 2)
-  c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-  return R * c  # in meters
-
 class SpeedLimitController:
-  def __init__(self):
+  def __init__(self, map_data):
     self.frogpilot_toggles = FrogPilotVariables.toggles
     FrogPilotVariables.update_frogpilot_params()
 
+    self.map_data = map_data
+
     self.params = Params()
-    self.params_memory = Params("/dev/shm/params")
 
     self.car_speed_limit = 0  # m/s
     self.map_speed_limit = 0  # m/s
@@ -31,12 +19,6 @@ class SpeedLimitController:
     self.nav_speed_limit = 0  # m/s
     self.prv_speed_limit = self.params.get_float("PreviousSpeedLimit")
 
-  def get_param_memory(self, key, is_json=False):
-    param_value = self.params_memory.get(key)
-    if param_value is None:
-      return {} if is_json else 0.0
-    return json.loads(param_value) if is_json else float(param_value)
-
   def update_previous_limit(self, speed_limit):
     if self.prv_speed_limit != speed_limit:
       self.params.put_float_nonblocking("PreviousSpeedLimit", speed_limit)
@@ -52,19 +34,15 @@ class SpeedLimitController:
     self.frogpilot_toggles = frogpilot_toggles
 
   def write_map_state(self, v_ego):
-    self.map_speed_limit = self.get_param_memory("MapSpeedLimit")
+    self.map_speed_limit = self.map_data.map_speed_limit
 
-    next_map_speed_limit = self.get_param_memory("NextMapSpeedLimit", is_json=True)
+    next_map_speed_limit = self.map_data.next_map_speed_limit
     next_map_speed_limit_value = next_map_speed_limit.get("speedlimit", 0)
     next_map_speed_limit_lat = next_map_speed_limit.get("latitude", 0)
     next_map_speed_limit_lon = next_map_speed_limit.get("longitude", 0)
 
-    position = self.get_param_memory("LastGPSPosition", is_json=True)
-    lat = position.get("latitude", 0)
-    lon = position.get("longitude", 0)
-
     if next_map_speed_limit_value > 1:
-      d = distance_to_point(lat * TO_RADIANS, lon * TO_RADIANS, next_map_speed_limit_lat * TO_RADIANS, next_map_speed_limit_lon * TO_RADIANS)
+      d = self.map_data.distance_to(next_map_speed_limit_lat, next_map_speed_limit_lon)
 
       if self.prv_speed_limit < next_map_speed_limit_value:
         max_d = self.frogpilot_toggles.map_speed_lookahead_higher * v_ego
@@ -24,11 +24,12 @@
 import os
 import requests
 import secrets
+import subprocess
 import traceback
 
 import openpilot.selfdrive.frogpilot.fleetmanager.helpers as fleet
 
-from flask import Flask, Response, jsonify, redirect, render_template, request, send_from_directory, session, url_for
+from flask import Flask, Response, jsonify, redirect, render_template, request, send_file, send_from_directory, session, url_for
 from requests.exceptions import ConnectionError
 
 from openpilot.common.realtime import set_core_affinity
@@ -53,7 +54,15 @@ def internal_error(exception):
 def full(cameratype, route):
   chunk_size = 1024 * 512  # 5KiB
   file_name = cameratype + (".ts" if cameratype == "qcamera" else ".hevc")
-  vidlist = "|".join(Paths.log_root() + "/" + segment + "/" + file_name for segment in fleet.segments_in_route(route))
+  file_names = [Paths.log_root() + "/" + segment + "/" + file_name for segment in fleet.segments_in_route(route)]
+  vidlist = "|".join(file_names)
+
+  # qcamera routes are small enough to keep in the remux cache, so they can be seeked
+  if cameratype == "qcamera":
+    try:
+      return send_file(fleet.remuxed_video(file_names, cameratype), mimetype='video/mp4', conditional=True)
+    except (OSError, subprocess.CalledProcessError):
+      return render_template("error.html", error="footage not found")
 
   def generate_buffered_stream():
     with fleet.ffmpeg_mp4_concat_wrap_process_builder(vidlist, cameratype, chunk_size) as process:
@@ -67,7 +76,11 @@ def fcamera(cameratype, segment):
   if not fleet.is_valid_segment(segment):
     return render_template("error.html", error="invalid segment")
   file_name = Paths.log_root() + "/" + segment + "/" + cameratype + (".ts" if cameratype == "qcamera" else ".hevc")
-  return Response(fleet.ffmpeg_mp4_wrap_process_builder(file_name).stdout.read(), status=200, mimetype='video/mp4')
+  try:
+    # served from the remux cache with Range support, so browsers can seek
+    return send_file(fleet.remuxed_video([file_name], cameratype), mimetype='video/mp4', conditional=True)
+  except (OSError, subprocess.CalledProcessError):
+    return render_template("error.html", error="footage not found")
 
 
 @app.route("/footage/<route>")
@@ -94,13 +107,7 @@ def route(route):
 @app.route("/footage")
 def footage():
   route_paths = fleet.all_routes()
-  gifs = []
-  for route_path in route_paths:
-    input_path = Paths.log_root() + route_path + "--0/qcamera.ts"
-    output_path = Paths.log_root() + route_path + "--0/preview.gif"
-    fleet.video_to_img(input_path, output_path)
-    gif_path = route_path + "--0/preview.gif"
-    gifs.append(gif_path)
+  gifs = [gif or "" for gif in fleet.request_thumbnails([route_path + "--0" for route_path in route_paths])]
   zipped = zip(route_paths, gifs)
   return render_template("footage.html", zipped=zipped)
 
@@ -109,16 +116,11 @@ def footage():
 def preserved():
   query_type = "qcamera"
   route_paths = []
-  gifs = []
   segments = fleet.preserved_routes()
   for segment in segments:
-    input_path = Paths.log_root() + segment + "/qcamera.ts"
-    output_path = Paths.log_root() + segment + "/preview.gif"
-    fleet.video_to_img(input_path, output_path)
     split_segment = segment.split("--")
     route_paths.append(f"{split_segment[0]}--{split_segment[1]}?{split_segment[2]},{query_type}")
-    gif_path = segment + "/preview.gif"
-    gifs.append(gif_path)
+  gifs = [gif or "" for gif in fleet.request_thumbnails(segments)]
 
   zipped = zip(route_paths, gifs, segments)
   return render_template("preserved.html", zipped=zipped)
@@ -315,8 +317,9 @@ def find_navicon(file_name):
 
 @app.route("/previewgif/<path:file_path>", methods=['GET'])
 def find_previewgif(file_path):
-  directory = "/data/media/0/realdata/"
-  return send_from_directory(directory, file_path, as_attachment=True)
+  # previews are generated in the background, give a queued one a moment to show up
+  fleet.wait_for_thumbnail(file_path, timeout=10)
+  return send_from_directory(fleet.THUMBNAIL_CACHE_PATH, file_path, as_attachment=True)
 
 @app.route("/tools", methods=['GET'])
 def tools_route():
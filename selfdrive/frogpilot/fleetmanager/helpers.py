@@ -20,14 +20,18 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
+import hashlib
 import json
 import math
 import os
 import requests
 import subprocess
+import threading
 import time
 # otisserv conversion
 from common.params import Params, ParamKeyType
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from flask import render_template, request, session
 from functools import wraps
 from pathlib import Path
@@ -61,9 +65,28 @@ PRESERVE_COUNT = 5
 if PC:
   SCREENRECORD_PATH = os.path.join(str(Path.home()), ".comma", "media", "screen_recordings", "")
   ERROR_LOGS_PATH = os.path.join(str(Path.home()), ".comma", "community", "crashes", "")
+  FOOTAGE_CACHE_PATH = os.path.join(str(Path.home()), ".comma", "fleet_manager", "footage", "")
+  THUMBNAIL_CACHE_PATH = os.path.join(str(Path.home()), ".comma", "fleet_manager", "thumbnails", "")
 else:
   SCREENRECORD_PATH = "/data/media/screen_recordings/"
   ERROR_LOGS_PATH = sentry.CRASHES_DIR
+  FOOTAGE_CACHE_PATH = "/data/fleet_manager/footage/"
+  THUMBNAIL_CACHE_PATH = "/data/fleet_manager/thumbnails/"
+
+FOOTAGE_CACHE_MAX_SIZE = 2 * 1024 * 1024 * 1024  # bytes
+REMUX_WORKERS = 2
+
+remux_executor = ThreadPoolExecutor(max_workers=REMUX_WORKERS, thread_name_prefix="remux")
+remux_jobs: dict[str, Future] = {}
+remux_lock = threading.Lock()
+
+THUMBNAIL_WORKERS = 2
+
+thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+thumbnail_jobs: dict[str, Future] = {}
+thumbnail_lock = threading.Lock()
+# segment -> names of its previews in THUMBNAIL_CACHE_PATH, scanned once and then kept up to date
+thumbnail_names: dict[str, set[str]] | None = None
 
 
 def list_files(path): # still used for footage
@@ -92,25 +115,61 @@ def segment_to_segment_name(data_dir, segment):
   return SegmentName(str(os.path.join(data_dir, fake_dongle + "|" + segment)))
 
 
-def all_segment_names():
-  segments = []
-  for segment in listdir_by_creation(Paths.log_root()):
+class RouteIndex:
+  """Segments and routes in the log root, only re-listed when a segment directory was added or
+     removed (which changes the root's mtime) and only parsing the names it hasn't seen yet.
+  """
+  def __init__(self, root):
+    self.root = root
+    self.lock = threading.Lock()
+    self.mtime = None
+    self.segment_names = {}  # segment -> SegmentName, or None for non-segment directories
+    self.routes = {}  # route time_str -> segments, in order of creation
+
+  def update(self):
     try:
-      segments.append(segment_to_segment_name(Paths.log_root(), segment))
-    except AssertionError:
-      pass
-  return segments
+      mtime = os.stat(self.root).st_mtime_ns
+    except OSError:
+      mtime = None
+
+    with self.lock:
+      if mtime == self.mtime and mtime is not None:
+        return
+
+      segment_names = {}
+      for segment in listdir_by_creation(self.root):
+        if segment in self.segment_names:
+          segment_names[segment] = self.segment_names[segment]
+          continue
+        try:
+          segment_names[segment] = segment_to_segment_name(self.root, segment)
+        except AssertionError:
+          segment_names[segment] = None
+
+      routes = {}
+      for segment_name in filter(None, segment_names.values()):
+        routes.setdefault(segment_name.time_str, []).append(segment_name.time_str + "--" + str(segment_name.segment_num))
+
+      self.segment_names = segment_names
+      self.routes = routes
+      self.mtime = mtime
+
+
+route_index = RouteIndex(Paths.log_root())
+
+
+def all_segment_names():
+  route_index.update()
+  return [segment_name for segment_name in route_index.segment_names.values() if segment_name is not None]
 
 
 def all_routes():
-  segment_names = all_segment_names()
-  route_names = [segment_name.route_name for segment_name in segment_names]
-  route_times = [route_name.time_str for route_name in route_names]
-  unique_routes = list(dict.fromkeys(route_times))
-  return sorted(unique_routes, reverse=True)
+  route_index.update()
+  return sorted(route_index.routes, reverse=True)
 
 def preserved_routes():
-  dirs = listdir_by_creation(Paths.log_root())
+  route_index.update()
+  dirs = list(route_index.segment_names)
   preserved_segments = get_preserved_segments(dirs)
   return sorted(preserved_segments, reverse=True)
 
@@ -154,14 +213,157 @@ def video_to_img(input_path, output_path, fps=1, duration=6):
   subprocess.run(['ffmpeg', '-y', '-i', input_path, '-ss', '5', '-vframes', '1', output_path])
   print(f"GIF file created: {output_path}")
 
+def thumbnail_name(segment):
+  try:
+    mtime = os.stat(os.path.join(Paths.log_root(), segment, "qcamera.ts")).st_mtime_ns
+  except OSError:
+    return None
+  return f"{segment}.{mtime}.gif"
+
+
+def cached_thumbnails():
+  global thumbnail_names
+  if thumbnail_names is None:
+    thumbnail_names = defaultdict(set)
+    if os.path.isdir(THUMBNAIL_CACHE_PATH):
+      for entry in os.scandir(THUMBNAIL_CACHE_PATH):
+        if entry.name.endswith(".gif") and not entry.name.endswith(".tmp.gif"):
+          thumbnail_names[entry.name.split(".", 1)[0]].add(entry.name)
+  return thumbnail_names
+
+
+def remove_thumbnails(names):
+  for name in names:
+    try:
+      os.remove(os.path.join(THUMBNAIL_CACHE_PATH, name))
+    except OSError:
+      pass
+
+
+def request_thumbnails(segments):
+  """request_thumbnail for every segment of a listing, previews of segments that were deleted since are dropped once afterwards."""
+  names = [request_thumbnail(segment) for segment in segments]
+
+  segment_names = route_index.segment_names
+  with thumbnail_lock:
+    thumbnails = cached_thumbnails()
+    stale = [segment for segment in thumbnails if segment not in segment_names]
+    stale_names = [name for segment in stale for name in thumbnails.pop(segment)]
+  remove_thumbnails(stale_names)
+  return names
+
+
+def request_thumbnail(segment):
+  """Returns the name of the segment's preview in THUMBNAIL_CACHE_PATH, queueing it on the
+     thumbnail workers if it wasn't generated yet. None when the segment has no qcamera.
+  """
+  name = thumbnail_name(segment)
+  if name is None:
+    return None
+
+  with thumbnail_lock:
+    if name not in thumbnail_jobs and not os.path.exists(os.path.join(THUMBNAIL_CACHE_PATH, name)):
+      job = thumbnail_executor.submit(generate_thumbnail, segment, name)
+      thumbnail_jobs[name] = job
+      job.add_done_callback(lambda _: thumbnail_jobs.pop(name, None))
+  return name
+
+
+def wait_for_thumbnail(name, timeout):
+  with thumbnail_lock:
+    job = thumbnail_jobs.get(name)
+  if job is not None:
+    try:
+      job.result(timeout=timeout)
+    except Exception:
+      pass
+  return os.path.exists(os.path.join(THUMBNAIL_CACHE_PATH, name))
+
+
+def generate_thumbnail(segment, name):
+  os.makedirs(THUMBNAIL_CACHE_PATH, exist_ok=True)
+  output_path = os.path.join(THUMBNAIL_CACHE_PATH, name)
+  tmp_path = output_path + ".tmp.gif"
+  try:
+    video_to_img(os.path.join(Paths.log_root(), segment, "qcamera.ts"), tmp_path)
+    if os.path.exists(tmp_path):
+      os.replace(tmp_path, output_path)
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
+  # drop the previews of older versions of the segment
+  if os.path.exists(output_path):
+    with thumbnail_lock:
+      thumbnails = cached_thumbnails()
+      old_names = thumbnails[segment] - {name}
+      thumbnails[segment] = {name}
+    remove_thumbnails(old_names)
+
+
 def segments_in_route(route):
-  segment_names = [segment_name for segment_name in all_segment_names() if segment_name.time_str == route]
-  segments = [segment_name.time_str + "--" + str(segment_name.segment_num) for segment_name in segment_names]
-  return segments
+  route_index.update()
+  return list(route_index.routes.get(route, []))
 
 
-def ffmpeg_mp4_concat_wrap_process_builder(file_list, cameratype, chunk_size=1024*512):
-  command_line = ["ffmpeg"]
+def remuxed_video(file_names, cameratype):
+  """Returns the path of a fragmented MP4 of the given videos back to back, remuxing them only
+     the first time. Concurrent requests for the same videos wait on one shared remux job.
+     The size of the inputs is part of the key, so a segment that is still being recorded
+     gets remuxed again once it grew.
+  """
+  key = "|".join(f"{file_name}:{os.path.getsize(file_name)}" for file_name in file_names)
+  cache_path = os.path.join(FOOTAGE_CACHE_PATH, hashlib.sha1(key.encode()).hexdigest() + ".mp4")
+
+  with remux_lock:
+    if os.path.exists(cache_path):
+      os.utime(cache_path)  # most recently used
+      return cache_path
+
+    job = remux_jobs.get(cache_path)
+    if job is None:
+      job = remux_executor.submit(remux_to_cache, "|".join(file_names), cameratype, cache_path)
+      remux_jobs[cache_path] = job
+      job.add_done_callback(lambda _: remux_jobs.pop(cache_path, None))
+
+  job.result()
+  return cache_path
+
+
+def remux_to_cache(file_list, cameratype, cache_path):
+  os.makedirs(FOOTAGE_CACHE_PATH, exist_ok=True)
+  tmp_path = cache_path + ".tmp"
+  try:
+    with ffmpeg_mp4_concat_wrap_process_builder(file_list, cameratype, output=tmp_path) as process:
+      if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    os.replace(tmp_path, cache_path)
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+  evict_footage_cache(keep=cache_path)
+
+
+def evict_footage_cache(keep=None):
+  entries = []
+  for entry in os.scandir(FOOTAGE_CACHE_PATH):
+    if entry.name.endswith(".mp4") and entry.path != keep:
+      stat = entry.stat()
+      entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+  total_size = sum(size for _, size, _ in entries) + (os.path.getsize(keep) if keep else 0)
+  for _, size, path in sorted(entries):
+    if total_size <= FOOTAGE_CACHE_MAX_SIZE:
+      break
+    try:
+      os.remove(path)
+      total_size -= size
+    except OSError:
+      pass
+
+
+def ffmpeg_mp4_concat_wrap_process_builder(file_list, cameratype, chunk_size=1024*512, output="-"):
+  command_line = ["ffmpeg", "-y"]
   if not cameratype == "qcamera":
     command_line += ["-f", "hevc"]
   command_line += ["-r", "20"]
@@ -171,10 +373,14 @@ def ffmpeg_mp4_concat_wrap_process_builder(file_list, cameratype, chunk_size=102
   if not cameratype == "qcamera":
     command_line += ["-vtag", "hvc1"]
   command_line += ["-f", "mp4"]
-  command_line += ["-movflags", "empty_moov"]
-  command_line += ["-"]
+  if output == "-":
+    command_line += ["-movflags", "empty_moov"]
+  else:
+    command_line += ["-movflags", "frag_keyframe+empty_moov+default_base_moof"]
+  command_line += [output]
   return subprocess.Popen(
-    command_line, stdout=subprocess.PIPE,
+    command_line, stdout=subprocess.PIPE if output == "-" else subprocess.DEVNULL,
+    stderr=None if output == "-" else subprocess.DEVNULL,
     bufsize=chunk_size
   )
 
@@ -13,7 +13,7 @@ import time
 import urllib.request
 
 from openpilot.common.basedir import BASEDIR
-from openpilot.common.numpy_fast import interp, mean
+from openpilot.common.numpy_fast import mean
 from openpilot.common.params_pyx import Params, ParamKeyType, UnknownKeyName
 from openpilot.common.time import system_time_valid
 from openpilot.system.hardware import HARDWARE
@@ -142,8 +142,8 @@ def calculate_lane_width(lane, current_lane, road_edge):
   current_x = np.array(current_lane.x)
   current_y = np.array(current_lane.y)
 
-  lane_y_interp = interp(current_x, np.array(lane.x), np.array(lane.y))
-  road_edge_y_interp = interp(current_x, np.array(road_edge.x), np.array(road_edge.y))
+  lane_y_interp = np.interp(current_x, np.array(lane.x), np.array(lane.y))
+  road_edge_y_interp = np.interp(current_x, np.array(road_edge.x), np.array(road_edge.y))
 
   distance_to_lane = np.mean(np.abs(current_y - lane_y_interp))
   distance_to_road_edge = np.mean(np.abs(current_y - road_edge_y_interp))
@@ -342,20 +342,27 @@ def uninstall_frogpilot():
   HARDWARE.uninstall()
 
 class MovingAverageCalculator:
-  def __init__(self):
+  def __init__(self, window_size=5):
+    self.window_size = window_size
     self.reset_data()
 
   def add_data(self, value):
-    if len(self.data) == 5:
-      self.total -= self.data.pop(0)
-    self.data.append(value)
+    # Fixed size ring buffer, the oldest value is overwritten once it's full
+    if self.count == self.window_size:
+      self.total -= self.data[self.index]
+    else:
+      self.count += 1
+    self.data[self.index] = value
     self.total += value
+    self.index = (self.index + 1) % self.window_size
 
   def get_moving_average(self):
-    if len(self.data) == 0:
+    if self.count == 0:
       return None
-    return self.total / len(self.data)
+    return self.total / self.count
 
   def reset_data(self):
-    self.data = []
+    self.data = [0] * self.window_size
+    self.count = 0
+    self.index = 0
     self.total = 0
@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import base64
+import bisect
 import bz2
 import hashlib
 import io
@@ -20,7 +21,7 @@ from datetime import datetime
 from functools import partial
 from queue import Queue
 from typing import cast
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
 
 import requests
 from jsonrpc import JSONRPCResponseManager, dispatcher
@@ -31,11 +32,12 @@ import cereal.messaging as messaging
 from cereal import log
 from cereal.services import SERVICE_LIST
 from openpilot.common.api import Api
-from openpilot.common.file_helpers import CallbackReader
+from openpilot.common.file_helpers import CallbackReader, atomic_write_in_dir
+from openpilot.common.inotify import Inotify, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware import HARDWARE, PC
-from openpilot.system.loggerd.xattr_cache import getxattr, setxattr
+from openpilot.system.loggerd.xattr_cache import getxattr_many, setxattr
 from openpilot.common.swaglog import cloudlog
 from openpilot.system.version import get_build_metadata
 from openpilot.system.hardware.hw import Paths
@@ -43,17 +45,26 @@ from openpilot.system.hardware.hw import Paths
 
 ATHENA_HOST = os.getenv('ATHENA_HOST', 'wss://athena.comma.ai')
 HANDLER_THREADS = int(os.getenv('HANDLER_THREADS', "4"))
+UPLOAD_HANDLER_THREADS = int(os.getenv('UPLOAD_HANDLER_THREADS', "4"))
 LOCAL_PORT_WHITELIST = {8022}
 
 LOG_ATTR_NAME = 'user.upload'
 LOG_ATTR_VALUE_MAX_UNIX_TIME = int.to_bytes(2147483647, 4, sys.byteorder)
 RECONNECT_TIMEOUT_S = 70
+LOG_FORWARD_WINDOW = 8  # forwardLogs requests in flight at once
+LOG_FORWARD_TIMEOUT = 100  # seconds
+LOG_RESEND_AGE = 3600  # seconds
 
 RETRY_DELAY = 10  # seconds
 MAX_RETRY_COUNT = 30  # Try for at most 5 minutes if upload fails immediately
 MAX_AGE = 31 * 24 * 3600  # seconds
 WS_FRAME_SIZE = 4096
 
+COMPRESSION_EXTENSIONS = ('.bz2', '.zst')
+UPLOAD_READ_SIZE = 1024 * 1024
+UPLOAD_BLOCK_SIZE = 4 * 1024 * 1024  # unit of resumption for block blob uploads
+UPLOAD_JOURNAL_COMPACT_MIN = 100  # entries
+
 NetworkType = log.DeviceState.NetworkType
 
 UploadFileDict = dict[str, str | int | float | bool]
@@ -85,11 +96,12 @@ class UploadItem:
   current: bool = False
   progress: float = 0
   allow_cellular: bool = False
+  uploaded_blocks: int = 0
 
   @classmethod
   def from_dict(cls, d: dict) -> UploadItem:
     return cls(d["path"], d["url"], d["headers"], d["created_at"], d["id"], d["retry_count"], d["current"],
-               d["progress"], d["allow_cellular"])
+               d["progress"], d["allow_cellular"], d.get("uploaded_blocks", 0))
 
 
 dispatcher["echo"] = lambda s: s
@@ -103,37 +115,96 @@ cancelled_uploads: set[str] = set()
 cur_upload_items: dict[int, UploadItem | None] = {}
 
 
-def strip_bz2_extension(fn: str) -> str:
-  if fn.endswith('.bz2'):
-    return fn[:-4]
-  return fn
+def strip_compression_extension(fn: str) -> tuple[str, str | None]:
+  for ext in COMPRESSION_EXTENSIONS:
+    if fn.endswith(ext):
+      return fn[:-len(ext)], ext
+  return fn, None
 
 
 class AbortTransferException(Exception):
   pass
 
 
+def upload_queue_journal_path() -> str:
+  if PC:
+    return os.path.join(Paths.comma_home(), "athena", "upload_queue.jsonl")
+  return "/data/athena/upload_queue.jsonl"
+
+
 class UploadQueueCache:
+  """
+  Persists the upload queue as an append-only journal of put/remove entries, so every change is a
+  single small write. Once most entries are dead, the journal is compacted into a snapshot of the live items.
+  """
+  lock = threading.Lock()
+  items: dict[str, UploadItemDict] = {}
+  entries = 0
 
-  @staticmethod
-  def initialize(upload_queue: Queue[UploadItem]) -> None:
-    try:
-      upload_queue_json = Params().get("AthenadUploadQueue")
-      if upload_queue_json is not None:
-        for item in json.loads(upload_queue_json):
+  @classmethod
+  def initialize(cls, upload_queue: Queue[UploadItem]) -> None:
+    with cls.lock:
+      cls.items = {}
+      try:
+        with open(upload_queue_journal_path()) as f:
+          for line in f:
+            entry = json.loads(line)
+            # requeued items go to the back, like in the queue
+            cls.items.pop(entry["id"], None)
+            if entry["op"] == "put":
+              cls.items[entry["id"]] = entry["item"]
+      except FileNotFoundError:
+        # migrate the queue from before the journal
+        upload_queue_json = Params().get("AthenadUploadQueue")
+        if upload_queue_json is not None:
+          for item in json.loads(upload_queue_json):
+            cls.items[item["id"]] = item
+      except Exception:
+        # a torn last line, keep what we have up to it
+        cloudlog.exception("athena.UploadQueueCache.initialize.exception")
+
+      try:
+        for item in cls.items.values():
           upload_queue.put(UploadItem.from_dict(item))
-    except Exception:
-      cloudlog.exception("athena.UploadQueueCache.initialize.exception")
+        cls._compact()
+        Params().remove("AthenadUploadQueue")
+      except Exception:
+        cloudlog.exception("athena.UploadQueueCache.initialize.exception")
+
+  @classmethod
+  def put(cls, item: UploadItem) -> None:
+    with cls.lock:
+      cls.items.pop(item.id, None)
+      cls.items[item.id] = asdict(item)
+      cls._append({"op": "put", "id": item.id, "item": cls.items[item.id]})
+
+  @classmethod
+  def remove(cls, item_id: str) -> None:
+    with cls.lock:
+      if cls.items.pop(item_id, None) is not None:
+        cls._append({"op": "remove", "id": item_id})
 
-  @staticmethod
-  def cache(upload_queue: Queue[UploadItem]) -> None:
+  @classmethod
+  def _append(cls, entry: dict) -> None:
     try:
-      queue: list[UploadItem | None] = list(upload_queue.queue)
-      items = [asdict(i) for i in queue if i is not None and (i.id not in cancelled_uploads)]
-      Params().put("AthenadUploadQueue", json.dumps(items))
+      with open(upload_queue_journal_path(), "a") as f:
+        f.write(json.dumps(entry) + "\n")
+      cls.entries += 1
+
+      if cls.entries > UPLOAD_JOURNAL_COMPACT_MIN and cls.entries > 2 * len(cls.items):
+        cls._compact()
     except Exception:
       cloudlog.exception("athena.UploadQueueCache.cache.exception")
 
+  @classmethod
+  def _compact(cls) -> None:
+    path = upload_queue_journal_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_write_in_dir(path, overwrite=True) as f:
+      for item_id, item in cls.items.items():
+        f.write(json.dumps({"op": "put", "id": item_id, "item": item}) + "\n")
+    cls.entries = len(cls.items)
+
 
 def handle_long_poll(ws: WebSocket, exit_event: threading.Event | None) -> None:
   end_event = threading.Event()
@@ -142,9 +213,11 @@ def handle_long_poll(ws: WebSocket, exit_event: threading.Event | None) -> None:
     threading.Thread(target=ws_manage, args=(ws, end_event), name='ws_manage'),
     threading.Thread(target=ws_recv, args=(ws, end_event), name='ws_recv'),
     threading.Thread(target=ws_send, args=(ws, end_event), name='ws_send'),
-    threading.Thread(target=upload_handler, args=(end_event,), name='upload_handler'),
     threading.Thread(target=log_handler, args=(end_event,), name='log_handler'),
     threading.Thread(target=stat_handler, args=(end_event,), name='stat_handler'),
+  ] + [
+    threading.Thread(target=upload_handler, args=(end_event,), name=f'upload_handler_{x}')
+    for x in range(UPLOAD_HANDLER_THREADS)
   ] + [
     threading.Thread(target=jsonrpc_handler, args=(end_event,), name=f'worker_{x}')
     for x in range(HANDLER_THREADS)
@@ -187,7 +260,9 @@ def jsonrpc_handler(end_event: threading.Event) -> None:
 
 def retry_upload(tid: int, end_event: threading.Event, increase_count: bool = True) -> None:
   item = cur_upload_items[tid]
-  if item is not None and item.retry_count < MAX_RETRY_COUNT:
+  if item is not None and item.retry_count >= MAX_RETRY_COUNT:
+    UploadQueueCache.remove(item.id)
+  elif item is not None:
     new_retry_count = item.retry_count + 1 if increase_count else item.retry_count
 
     item = replace(
@@ -197,7 +272,7 @@ def retry_upload(tid: int, end_event: threading.Event, increase_count: bool = Tr
       current=False
     )
     upload_queue.put_nowait(item)
-    UploadQueueCache.cache(upload_queue)
+    UploadQueueCache.put(item)
 
     cur_upload_items[tid] = None
 
@@ -218,9 +293,18 @@ def cb(sm, item, tid, end_event: threading.Event, sz: int, cur: int) -> None:
   if end_event.is_set():
     raise AbortTransferException
 
+  # the block upload can have updated the current item since this partial was made
+  item = cur_upload_items[tid] or item
   cur_upload_items[tid] = replace(item, progress=cur / sz if sz else 1)
 
 
+def set_uploaded_blocks(tid: int, uploaded_blocks: int) -> None:
+  # kept on the current item, so retry_upload requeues it with the staged blocks
+  item = cur_upload_items[tid]
+  if item is not None:
+    cur_upload_items[tid] = replace(item, uploaded_blocks=uploaded_blocks)
+
+
 def upload_handler(end_event: threading.Event) -> None:
   sm = messaging.SubMaster(['deviceState'])
   tid = threading.get_ident()
@@ -232,13 +316,14 @@ def upload_handler(end_event: threading.Event) -> None:
       cur_upload_items[tid] = item = replace(upload_queue.get(timeout=1), current=True)
 
       if item.id in cancelled_uploads:
-        cancelled_uploads.remove(item.id)
+        cancelled_uploads.discard(item.id)
         continue
 
       # Remove item if too old
       age = datetime.now() - datetime.fromtimestamp(item.created_at / 1000)
       if age.total_seconds() > MAX_AGE:
         cloudlog.event("athena.upload_handler.expired", item=item, error=True)
+        UploadQueueCache.remove(item.id)
         continue
 
       # Check if uploading over metered connection is allowed
@@ -257,15 +342,14 @@ def upload_handler(end_event: threading.Event) -> None:
           sz = -1
 
         cloudlog.event("athena.upload_handler.upload_start", fn=fn, sz=sz, network_type=network_type, metered=metered, retry_count=item.retry_count)
-        response = _do_upload(item, partial(cb, sm, item, tid, end_event))
+        response = _do_upload(item, partial(cb, sm, item, tid, end_event), partial(set_uploaded_blocks, tid))
 
         if response.status_code not in (200, 201, 401, 403, 412):
           cloudlog.event("athena.upload_handler.retry", status_code=response.status_code, fn=fn, sz=sz, network_type=network_type, metered=metered)
           retry_upload(tid, end_event)
         else:
           cloudlog.event("athena.upload_handler.success", fn=fn, sz=sz, network_type=network_type, metered=metered)
-
-        UploadQueueCache.cache(upload_queue)
+          UploadQueueCache.remove(item.id)
       except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.SSLError):
         cloudlog.event("athena.upload_handler.timeout", fn=fn, sz=sz, network_type=network_type, metered=metered)
         retry_upload(tid, end_event)
@@ -279,25 +363,107 @@ def upload_handler(end_event: threading.Event) -> None:
       cloudlog.exception("athena.upload_handler.exception")
 
 
-def _do_upload(upload_item: UploadItem, callback: Callable = None) -> requests.Response:
-  path = upload_item.path
-  compress = False
+def _compressobj(ext: str):
+  if ext == '.bz2':
+    return bz2.BZ2Compressor()
+  import zstandard
+  return zstandard.ZstdCompressor().compressobj()
+
 
-  # If file does not exist, but does exist without the .bz2 extension we will compress on the fly
-  if not os.path.exists(path) and os.path.exists(strip_bz2_extension(path)):
-    path = strip_bz2_extension(path)
-    compress = True
+def _iter_upload_blocks(path: str, compress_ext: str | None, skip_blocks: int = 0,
+                        callback: Callable = None) -> Iterator[tuple[int, bytes]]:
+  """Reads path, compressing on the fly, and yields (index, data) blocks of UPLOAD_BLOCK_SIZE
+  from skip_blocks onwards. Only one block is held in memory at a time."""
+  sz = os.path.getsize(path)
+  compressor = _compressobj(compress_ext) if compress_ext is not None else None
+  index = 0
+  buf = bytearray()
 
   with open(path, "rb") as f:
-    content = f.read()
-    if compress:
+    if compressor is None and skip_blocks:
+      f.seek(skip_blocks * UPLOAD_BLOCK_SIZE)
+      index = skip_blocks
+
+    while chunk := f.read(UPLOAD_READ_SIZE):
+      buf += compressor.compress(chunk) if compressor is not None else chunk
+      while len(buf) >= UPLOAD_BLOCK_SIZE:
+        # compressed blocks are regenerated to skip them, the output is deterministic
+        if index >= skip_blocks:
+          yield index, bytes(buf[:UPLOAD_BLOCK_SIZE])
+        del buf[:UPLOAD_BLOCK_SIZE]
+        index += 1
+
+      if callback:
+        callback(sz, f.tell())
+
+  if compressor is not None:
+    buf += compressor.flush()
+  while len(buf):
+    if index >= skip_blocks:
+      yield index, bytes(buf[:UPLOAD_BLOCK_SIZE])
+    del buf[:UPLOAD_BLOCK_SIZE]
+    index += 1
+
+
+def _block_id(index: int) -> str:
+  # all ids of a blob need the same length
+  return base64.b64encode(f"{index:08d}".encode()).decode()
+
+
+def _do_block_upload(upload_item: UploadItem, path: str, compress_ext: str | None, callback: Callable = None,
+                     blocks_callback: Callable[[int], None] = None) -> requests.Response:
+  # Blocks are staged one by one and then committed, so a retry resumes after the last staged block.
+  # blocks_callback gets the number of staged blocks, which the retry has to start from.
+  headers = {k: v for k, v in upload_item.headers.items() if k.lower() != 'x-ms-blob-type'}
+  uploaded_blocks = upload_item.uploaded_blocks
+
+  # one connection for all blocks of the upload
+  with requests.Session() as session:
+    for index, block in _iter_upload_blocks(path, compress_ext, uploaded_blocks, callback):
+      response = session.put(upload_item.url, params={"comp": "block", "blockid": _block_id(index)}, data=block, headers=headers, timeout=30)
+      if response.status_code not in (200, 201):
+        return response
+      uploaded_blocks = index + 1
+      if blocks_callback:
+        blocks_callback(uploaded_blocks)
+
+    block_list = "".join(f"<Latest>{_block_id(i)}</Latest>" for i in range(uploaded_blocks))
+    response = session.put(upload_item.url, params={"comp": "blocklist"}, headers=headers, timeout=30,
+                           data=f'<?xml version="1.0" encoding="utf-8"?><BlockList>{block_list}</BlockList>')
+  if response.status_code == 400 and blocks_callback:
+    # staged blocks expired or never made it, start over on the next attempt
+    blocks_callback(0)
+  return response
+
+
+def _do_upload(upload_item: UploadItem, callback: Callable = None, blocks_callback: Callable[[int], None] = None) -> requests.Response:
+  path = upload_item.path
+  compress_ext = None
+
+  # If file does not exist, but does exist without the .bz2 or .zst extension we will compress on the fly
+  if not os.path.exists(path):
+    stripped_path, ext = strip_compression_extension(path)
+    if ext is not None and os.path.exists(stripped_path):
+      path = stripped_path
+      compress_ext = ext
       cloudlog.event("athena.upload_handler.compress", fn=path, fn_orig=upload_item.path)
-      content = bz2.compress(content)
 
-  with io.BytesIO(content) as data:
+  if any(k.lower() == 'x-ms-blob-type' and v == 'BlockBlob' for k, v in upload_item.headers.items()):
+    return _do_block_upload(upload_item, path, compress_ext, callback, blocks_callback)
+
+  # Single PUT, the compressed data is spooled first since the length has to be known up front
+  with open(path, "rb") as f, tempfile.SpooledTemporaryFile(max_size=UPLOAD_BLOCK_SIZE) as spool:
+    if compress_ext is None:
+      data, size = f, os.fstat(f.fileno()).st_size
+    else:
+      for _, block in _iter_upload_blocks(path, compress_ext):
+        spool.write(block)
+      data, size = spool, spool.tell()
+      spool.seek(0)
+
     return requests.put(upload_item.url,
-                        data=CallbackReader(data, callback, len(content)) if callback else data,
-                        headers={**upload_item.headers, 'Content-Length': str(len(content))},
+                        data=CallbackReader(data, callback, size) if callback else data,
+                        headers={**upload_item.headers, 'Content-Length': str(size)},
                         timeout=30)
 
 
@@ -388,7 +554,7 @@ def uploadFilesToUrls(files_data: list[UploadFileDict]) -> UploadFilesToUrlRespo
       continue
 
     path = os.path.join(Paths.log_root(), file.fn)
-    if not os.path.exists(path) and not os.path.exists(strip_bz2_extension(path)):
+    if not os.path.exists(path) and not os.path.exists(strip_compression_extension(path)[0]):
       failed.append(file.fn)
       continue
 
@@ -408,10 +574,9 @@ def uploadFilesToUrls(files_data: list[UploadFileDict]) -> UploadFilesToUrlRespo
     upload_id = hashlib.sha1(str(item).encode()).hexdigest()
     item = replace(item, id=upload_id)
     upload_queue.put_nowait(item)
+    UploadQueueCache.put(item)
     items.append(asdict(item))
 
-  UploadQueueCache.cache(upload_queue)
-
   resp: UploadFilesToUrlResponse = {"enqueued": len(items), "items": items}
   if failed:
     resp["failed"] = failed
@@ -436,6 +601,8 @@ def cancelUpload(upload_id: str | list[str]) -> dict[str, int | str]:
     return {"success": 0, "error": "not found"}
 
   cancelled_uploads.update(cancelled_ids)
+  for cancelled_id in cancelled_ids:
+    UploadQueueCache.remove(cancelled_id)
   return {"success": 1}
 
 @dispatcher.add_method
@@ -549,86 +716,168 @@ def takeSnapshot() -> str | dict[str, str] | None:
     raise Exception("not available while camerad is started")
 
 
-def get_logs_to_send_sorted() -> list[str]:
-  # TODO: scan once then use inotify to detect file creation/deletion
-  curr_time = int(time.time())
-  logs = []
-  for log_entry in os.listdir(Paths.swaglog_root()):
-    log_path = os.path.join(Paths.swaglog_root(), log_entry)
-    time_sent = 0
+class LogShipper:
+  """
+  Forwards swaglogs newest first, keeping up to LOG_FORWARD_WINDOW forwardLogs requests outstanding.
+  The directory is scanned once and then followed through inotify, the send state is kept in memory
+  and mirrored to the log's xattr so it survives restarts.
+  """
+  def __init__(self, root: str):
+    self.root = root
+    self.newest = ""  # the log that is still being written
+    self.pending: list[str] = []  # sorted, sent from the back
+    self.outstanding: dict[str, float] = {}
+    self.unconfirmed: dict[str, float] = {}
+    self.last_scan = 0.
+
+    self.inotify: Inotify | None = None
     try:
-      value = getxattr(log_path, LOG_ATTR_NAME)
-      if value is not None:
-        time_sent = int.from_bytes(value, sys.byteorder)
-    except (ValueError, TypeError):
-      pass
-    # assume send failed and we lost the response if sent more than one hour ago
-    if not time_sent or curr_time - time_sent > 3600:
-      logs.append(log_entry)
-  # excluding most recent (active) log file
-  return sorted(logs)[:-1]
+      self.inotify = Inotify()
+      self.inotify.add_watch(root, IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_ONLYDIR)
+    except OSError:
+      cloudlog.exception("athena.log_handler.inotify_failed")
+      if self.inotify is not None:
+        self.inotify.close()
+      self.inotify = None
+
+    try:
+      self.scan()
+    except Exception:
+      self.close()
+      raise
+
+  def close(self) -> None:
+    if self.inotify is not None:
+      self.inotify.close()
+
+  def scan(self) -> None:
+    curr_time = int(time.time())
+    log_entries = sorted(os.listdir(self.root))
+    # excluding most recent (active) log file
+    self.newest = log_entries[-1] if len(log_entries) else ""
+    log_entries = log_entries[:-1]
+
+    self.pending = []
+    values = getxattr_many([os.path.join(self.root, log_entry) for log_entry in log_entries], LOG_ATTR_NAME)
+    for log_entry, value in zip(log_entries, values, strict=True):
+      time_sent = 0
+      try:
+        if value is not None:
+          time_sent = int.from_bytes(value, sys.byteorder)
+      except (ValueError, TypeError):
+        pass
+      # assume send failed and we lost the response if sent more than one hour ago
+      if (not time_sent or curr_time - time_sent > LOG_RESEND_AGE) and log_entry not in self.outstanding:
+        self.pending.append(log_entry)
+    self.last_scan = time.monotonic()
+
+  def _add(self, log_entry: str) -> None:
+    if log_entry > self.newest:
+      log_entry, self.newest = self.newest, log_entry
+    if log_entry and log_entry not in self.outstanding:
+      idx = bisect.bisect_left(self.pending, log_entry)
+      if idx == len(self.pending) or self.pending[idx] != log_entry:
+        self.pending.insert(idx, log_entry)
+
+  def _remove(self, log_entry: str) -> None:
+    self.outstanding.pop(log_entry, None)
+    self.unconfirmed.pop(log_entry, None)
+    idx = bisect.bisect_left(self.pending, log_entry)
+    if idx < len(self.pending) and self.pending[idx] == log_entry:
+      del self.pending[idx]
+
+  def update(self) -> None:
+    if self.inotify is None:
+      if time.monotonic() - self.last_scan > 10:
+        self.scan()
+    else:
+      for event in self.inotify.read():
+        if event.mask & IN_Q_OVERFLOW:
+          self.scan()
+        elif event.mask & (IN_CREATE | IN_MOVED_TO):
+          self._add(event.name)
+        elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+          self._remove(event.name)
+
+    now = time.monotonic()
+    for log_entry, sent in list(self.outstanding.items()):
+      if now - sent > LOG_FORWARD_TIMEOUT:
+        del self.outstanding[log_entry]
+        self.unconfirmed[log_entry] = sent
+    for log_entry, sent in list(self.unconfirmed.items()):
+      if now - sent > LOG_RESEND_AGE:
+        del self.unconfirmed[log_entry]
+        self._add(log_entry)
+
+  def send(self) -> None:
+    while len(self.outstanding) < LOG_FORWARD_WINDOW and len(self.pending) > 0:
+      log_entry = self.pending.pop() # newest log file
+      cloudlog.debug(f"athena.log_handler.forward_request {log_entry}")
+      try:
+        curr_time = int(time.time())
+        log_path = os.path.join(self.root, log_entry)
+        setxattr(log_path, LOG_ATTR_NAME, int.to_bytes(curr_time, 4, sys.byteorder))
+        with open(log_path) as f:
+          jsonrpc = {
+            "method": "forwardLogs",
+            "params": {
+              "logs": f.read()
+            },
+            "jsonrpc": "2.0",
+            "id": log_entry
+          }
+          low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
+          self.outstanding[log_entry] = time.monotonic()
+      except OSError:
+        pass  # file could be deleted by log rotation
+
+  def handle_response(self, log_resp: dict) -> None:
+    log_entry = log_resp.get("id")
+    log_success = "result" in log_resp and log_resp["result"].get("success")
+    cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
+
+    sent = self.outstanding.pop(log_entry, None)
+    if log_entry and log_success:
+      self.unconfirmed.pop(log_entry, None)
+      log_path = os.path.join(self.root, log_entry)
+      try:
+        setxattr(log_path, LOG_ATTR_NAME, LOG_ATTR_VALUE_MAX_UNIX_TIME)
+      except OSError:
+        pass  # file could be deleted by log rotation
+    elif sent is not None:
+      self.unconfirmed[log_entry] = sent
 
 
 def log_handler(end_event: threading.Event) -> None:
   if PC:
     return
 
-  log_files = []
-  last_scan = 0.
-  while not end_event.is_set():
-    try:
-      curr_scan = time.monotonic()
-      if curr_scan - last_scan > 10:
-        log_files = get_logs_to_send_sorted()
-        last_scan = curr_scan
+  shipper: LogShipper | None = None
+  try:
+    while not end_event.is_set():
+      try:
+        # created in the loop, so a swaglog dir that can't be read yet doesn't end the thread
+        if shipper is None:
+          shipper = LogShipper(Paths.swaglog_root())
 
-      # send one log
-      curr_log = None
-      if len(log_files) > 0:
-        log_entry = log_files.pop() # newest log file
-        cloudlog.debug(f"athena.log_handler.forward_request {log_entry}")
-        try:
-          curr_time = int(time.time())
-          log_path = os.path.join(Paths.swaglog_root(), log_entry)
-          setxattr(log_path, LOG_ATTR_NAME, int.to_bytes(curr_time, 4, sys.byteorder))
-          with open(log_path) as f:
-            jsonrpc = {
-              "method": "forwardLogs",
-              "params": {
-                "logs": f.read()
-              },
-              "jsonrpc": "2.0",
-              "id": log_entry
-            }
-            low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
-            curr_log = log_entry
-        except OSError:
-          pass  # file could be deleted by log rotation
+        shipper.update()
+        shipper.send()
 
-      # wait for response up to ~100 seconds
-      # always read queue at least once to process any old responses that arrive
-      for _ in range(100):
-        if end_event.is_set():
-          break
+        # always read queue at least once to process any old responses that arrive
         try:
-          log_resp = json.loads(log_recv_queue.get(timeout=1))
-          log_entry = log_resp.get("id")
-          log_success = "result" in log_resp and log_resp["result"].get("success")
-          cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
-          if log_entry and log_success:
-            log_path = os.path.join(Paths.swaglog_root(), log_entry)
-            try:
-              setxattr(log_path, LOG_ATTR_NAME, LOG_ATTR_VALUE_MAX_UNIX_TIME)
-            except OSError:
-              pass  # file could be deleted by log rotation
-          if curr_log == log_entry:
-            break
+          shipper.handle_response(json.loads(log_recv_queue.get(timeout=1)))
+          while True:
+            shipper.handle_response(json.loads(log_recv_queue.get_nowait()))
         except queue.Empty:
-          if curr_log is None:
-            break
+          pass
 
-    except Exception:
-      cloudlog.exception("athena.log_handler.exception")
+      except Exception:
+        cloudlog.exception("athena.log_handler.exception")
+        if shipper is None:
+          end_event.wait(1)
+  finally:
+    if shipper is not None:
+      shipper.close()
 
 
 def stat_handler(end_event: threading.Event) -> None:
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from dataclasses import replace
+
+import pytest
+
+from openpilot.system.athena import athenad
+
+BLOCK_SIZE = 1024
+
+
+class MockResponse:
+  def __init__(self, status_code):
+    self.status_code = status_code
+
+
+class MockSession:
+  """Records the Put Block/Put Block List calls, fail_block and commit_status pick the responses."""
+  instances: list['MockSession'] = []
+  blocks: dict[str, bytes] = {}
+  committed: list[str] = []
+  fail_block: str | None = None
+  commit_status = 201
+
+  def __init__(self):
+    self.calls = []
+    MockSession.instances.append(self)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    pass
+
+  def put(self, url, params, data, headers, timeout):
+    self.calls.append(params)
+    if params["comp"] == "block":
+      if params["blockid"] == MockSession.fail_block:
+        return MockResponse(500)
+      MockSession.blocks[params["blockid"]] = data
+      return MockResponse(201)
+
+    MockSession.committed = [block_id.split("</Latest>")[0] for block_id in data.split("<Latest>")[1:]]
+    return MockResponse(MockSession.commit_status)
+
+
+@pytest.fixture
+def upload_item(tmp_path, monkeypatch):
+  monkeypatch.setattr(athenad, "UPLOAD_BLOCK_SIZE", BLOCK_SIZE)
+  monkeypatch.setattr(athenad, "UPLOAD_READ_SIZE", BLOCK_SIZE // 4)
+  monkeypatch.setattr(athenad, "RETRY_DELAY", 0)
+  monkeypatch.setattr(athenad.requests, "Session", MockSession)
+  monkeypatch.setattr(athenad.UploadQueueCache, "put", classmethod(lambda cls, item: None))
+  monkeypatch.setattr(athenad.UploadQueueCache, "remove", classmethod(lambda cls, item_id: None))
+
+  MockSession.instances = []
+  MockSession.blocks = {}
+  MockSession.committed = []
+  MockSession.fail_block = None
+  MockSession.commit_status = 201
+
+  fn = tmp_path / "qlog"
+  fn.write_bytes(os.urandom(BLOCK_SIZE * 2 + BLOCK_SIZE // 2))
+  item = athenad.UploadItem(path=str(fn), url="http://localhost/qlog", headers={"x-ms-blob-type": "BlockBlob"},
+                            created_at=int(time.time() * 1000), id="id")
+  yield item
+
+  athenad.cur_upload_items.clear()
+  while not athenad.upload_queue.empty():
+    athenad.upload_queue.get_nowait()
+
+
+def attempt(item: athenad.UploadItem) -> tuple[MockResponse, athenad.UploadItem]:
+  # what upload_handler does for a single attempt, returns the item retry_upload requeues
+  tid = threading.get_ident()
+  athenad.cur_upload_items[tid] = item
+  response = athenad._do_upload(item, None, lambda n: athenad.set_uploaded_blocks(tid, n))
+  if response.status_code not in (200, 201):
+    end_event = threading.Event()
+    end_event.set()
+    athenad.retry_upload(tid, end_event)
+    return response, athenad.upload_queue.get_nowait()
+  return response, athenad.cur_upload_items[tid]
+
+
+def test_block_upload_uses_one_session(upload_item):
+  response, _ = attempt(upload_item)
+  assert response.status_code == 201
+  assert len(MockSession.instances) == 1
+  assert len(MockSession.instances[0].calls) == 4  # three blocks and the block list
+
+  data = b"".join(MockSession.blocks[block_id] for block_id in MockSession.committed)
+  with open(upload_item.path, "rb") as f:
+    assert data == f.read()
+
+
+def test_block_upload_resumes(upload_item):
+  MockSession.fail_block = athenad._block_id(1)
+  response, requeued = attempt(upload_item)
+  assert response.status_code == 500
+  assert requeued.uploaded_blocks == 1
+  assert requeued.retry_count == 1
+
+  MockSession.fail_block = None
+  response, _ = attempt(replace(requeued, current=True))
+  assert response.status_code == 201
+
+  # only the blocks after the staged one are sent again
+  staged = [params["blockid"] for params in MockSession.instances[1].calls if params["comp"] == "block"]
+  assert staged == [athenad._block_id(1), athenad._block_id(2)]
+  assert MockSession.committed == [athenad._block_id(i) for i in range(3)]
+
+  data = b"".join(MockSession.blocks[block_id] for block_id in MockSession.committed)
+  with open(upload_item.path, "rb") as f:
+    assert data == f.read()
+
+
+def test_block_upload_restarts_after_rejected_block_list(upload_item):
+  MockSession.commit_status = 400
+  response, requeued = attempt(upload_item)
+  assert response.status_code == 400
+  assert requeued.uploaded_blocks == 0
+
+  MockSession.commit_status = 201
+  response, _ = attempt(replace(requeued, current=True))
+  assert response.status_code == 201
+  staged = [params["blockid"] for params in MockSession.instances[1].calls if params["comp"] == "block"]
+  assert staged == [athenad._block_id(i) for i in range(3)]
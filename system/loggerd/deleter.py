@@ -5,8 +5,8 @@ import threading
 from openpilot.system.hardware.hw import Paths
 from openpilot.common.swaglog import cloudlog
 from openpilot.system.loggerd.config import get_available_bytes, get_available_percent
-from openpilot.system.loggerd.uploader import listdir_by_creation
-from openpilot.system.loggerd.xattr_cache import getxattr
+from openpilot.system.loggerd.segment_catalog import SegmentCatalog
+from openpilot.system.loggerd.xattr_cache import getxattr, invalidate
 
 MIN_BYTES = 5 * 1024 * 1024 * 1024
 MIN_PERCENT = 10
@@ -45,12 +45,17 @@ def get_preserved_segments(dirs_by_creation: list[str]) -> list[str]:
 
 
 def deleter_thread(exit_event):
+  catalog = SegmentCatalog(Paths.log_root())
+
   while not exit_event.is_set():
+    # keep draining events while idle so the inotify queue doesn't overflow
+    catalog.update()
+
     out_of_bytes = get_available_bytes(default=MIN_BYTES + 1) < MIN_BYTES
     out_of_percent = get_available_percent(default=MIN_PERCENT + 1) < MIN_PERCENT
 
     if out_of_percent or out_of_bytes:
-      dirs = listdir_by_creation(Paths.log_root())
+      dirs = catalog.segments_by_creation()
 
       # skip deleting most recent N preserved segments (and their prior segment)
       preserved_dirs = get_preserved_segments(dirs)
@@ -59,7 +64,7 @@ def deleter_thread(exit_event):
       for delete_dir in sorted(dirs, key=lambda d: (d in DELETE_LAST, d in preserved_dirs)):
         delete_path = os.path.join(Paths.log_root(), delete_dir)
 
-        if any(name.endswith(".lock") for name in os.listdir(delete_path)):
+        if catalog.is_locked(delete_dir):
           continue
 
         try:
@@ -68,6 +73,7 @@ def deleter_thread(exit_event):
             os.remove(delete_path)
           else:
             shutil.rmtree(delete_path)
+          invalidate(delete_path)
           break
         except OSError:
           cloudlog.exception(f"issue deleting {delete_path}")
@@ -0,0 +1,238 @@
+import os
+import stat
+from dataclasses import dataclass, field
+
+from openpilot.common.inotify import Inotify, IN_ATTRIB, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_ISDIR, \
+                                     IN_MOVE_SELF, IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW
+from openpilot.common.swaglog import cloudlog
+from openpilot.system.loggerd.xattr_cache import getxattr, invalidate
+
+UPLOAD_ATTR_NAME = 'user.upload'
+UPLOAD_ATTR_VALUE = b'1'
+
+ROOT_WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+SEGMENT_WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE | IN_ATTRIB | IN_ONLYDIR
+
+
+def get_directory_sort(d: str) -> list[str]:
+  # ensure old format is sorted sooner
+  o = ["0", ] if d.startswith("2024-") else ["1", ]
+  return o + [s.rjust(10, '0') for s in d.rsplit('--', 1)]
+
+
+@dataclass
+class SegmentFile:
+  size: int
+  ctime: float
+  uploaded: bool
+
+
+@dataclass
+class Segment:
+  files: dict[str, SegmentFile] = field(default_factory=dict)
+  locks: set[str] = field(default_factory=set)
+  pending: set[str] = field(default_factory=set)  # files not uploaded yet
+
+  @property
+  def locked(self) -> bool:
+    return len(self.locks) > 0
+
+
+class SegmentCatalog:
+  """
+  In-memory view of the segment directories in the log root for the uploader and deleter.
+
+  The root is scanned once, after which inotify events keep the files, their upload state, size and
+  the segment lock files current, so a query only costs as much as what changed since the last one.
+  Without inotify every update() falls back to a full rescan, and segments that couldn't be watched
+  (e.g. max_user_watches is exhausted) are relisted on every update() until a watch succeeds.
+  """
+  def __init__(self, root: str):
+    self.root = root
+    self.segments: dict[str, Segment] = {}
+    self.unwatched: set[str] = set()
+    self.root_watched = False
+    self.inotify: Inotify | None = None
+
+    self._by_creation: list[str] | None = None
+    self._pending_by_creation: list[str] | None = None
+
+    try:
+      self.inotify = Inotify()
+    except OSError:
+      cloudlog.warning("segment catalog: inotify unavailable, rescanning on every update")
+
+    self.scan()
+
+  def close(self) -> None:
+    if self.inotify is not None:
+      self.inotify.close()
+
+  def segments_by_creation(self) -> list[str]:
+    if self._by_creation is None:
+      self._by_creation = sorted(self.segments, key=get_directory_sort)
+    return self._by_creation
+
+  def pending_by_creation(self) -> list[str]:
+    """Segments with files that aren't uploaded yet, oldest first."""
+    if self._pending_by_creation is None:
+      self._pending_by_creation = [d for d in self.segments_by_creation() if self.segments[d].pending]
+    return self._pending_by_creation
+
+  def is_locked(self, d: str) -> bool:
+    segment = self.segments.get(d)
+    return segment is not None and segment.locked
+
+  def update(self) -> None:
+    if self.inotify is None or self.inotify.fd < 0 or not self.root_watched:
+      self.scan()
+      return
+
+    for event in self.inotify.read():
+      if event.mask & IN_Q_OVERFLOW:
+        cloudlog.warning("segment catalog: inotify queue overflowed, rescanning")
+        self.scan()
+        return
+
+      if event.path == self.root:
+        if event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+          self.scan()
+          return
+        if not event.mask & IN_ISDIR:
+          continue
+
+        if event.mask & (IN_CREATE | IN_MOVED_TO):
+          self._add_segment(event.name)
+        elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+          invalidate(os.path.join(self.root, event.name))
+          self._remove_segment(event.name)
+      elif event.path is not None:
+        segment = self.segments.get(os.path.basename(event.path))
+        if segment is None or event.mask & IN_ISDIR or not event.name:
+          continue
+
+        path = os.path.join(event.path, event.name)
+        if event.mask & (IN_DELETE | IN_MOVED_FROM):
+          invalidate(path)
+          self._remove_file(segment, event.name)
+        elif event.mask & IN_CREATE:
+          # freshly created files can't carry the upload attribute yet
+          self._add_file(segment, path, event.name, read_attr=False)
+        elif event.mask & (IN_MOVED_TO | IN_ATTRIB):
+          self._add_file(segment, path, event.name, read_attr=True)
+        elif event.mask & IN_CLOSE_WRITE and event.name in segment.files:
+          try:
+            segment.files[event.name].size = os.path.getsize(path)
+          except OSError:
+            self._remove_file(segment, event.name)
+
+    # the root didn't exist yet when we last looked
+    if not self.inotify.watches:
+      self.scan()
+      return
+
+    for d in list(self.unwatched):
+      self._add_segment(d)
+
+  def scan(self) -> None:
+    if self.inotify is not None:
+      for wd in list(self.inotify.watches):
+        self.inotify.rm_watch(wd)
+      # throw away events for the old watches
+      self.inotify.read()
+
+    self.segments = {}
+    self.unwatched = set()
+    self.root_watched = False
+    self._invalidate_order()
+
+    if not os.path.isdir(self.root):
+      return
+
+    if self.inotify is not None:
+      try:
+        self.inotify.add_watch(self.root, ROOT_WATCH_MASK)
+        self.root_watched = True
+      except OSError:
+        cloudlog.exception("segment catalog: failed to watch log root")
+
+    try:
+      names = os.listdir(self.root)
+    except OSError:
+      cloudlog.exception("segment catalog: listdir failed")
+      return
+
+    for d in names:
+      self._add_segment(d)
+
+  def _add_segment(self, d: str) -> None:
+    path = os.path.join(self.root, d)
+    if not os.path.isdir(path):
+      self._remove_segment(d)
+      return
+
+    # watch before listing, so files created in between are seen by one of the two
+    if self.inotify is not None:
+      try:
+        self.inotify.add_watch(path, SEGMENT_WATCH_MASK)
+        self.unwatched.discard(d)
+      except OSError:
+        # keep the segment, update() relists it until it can be watched
+        if d not in self.unwatched:
+          cloudlog.exception(f"segment catalog: failed to watch {d}")
+        self.unwatched.add(d)
+
+    segment = Segment()
+    self.segments[d] = segment
+    self._invalidate_order()
+
+    try:
+      names = os.listdir(path)
+    except OSError:
+      return
+
+    for name in names:
+      self._add_file(segment, os.path.join(path, name), name, read_attr=True)
+
+  def _remove_segment(self, d: str) -> None:
+    self.unwatched.discard(d)
+    if self.segments.pop(d, None) is not None:
+      self._invalidate_order()
+
+  def _add_file(self, segment: Segment, path: str, name: str, read_attr: bool) -> None:
+    if name.endswith(".lock"):
+      segment.locks.add(name)
+      return
+
+    try:
+      st = os.stat(path)
+      if stat.S_ISDIR(st.st_mode):
+        return
+      uploaded = read_attr and getxattr(path, UPLOAD_ATTR_NAME, st) == UPLOAD_ATTR_VALUE
+    except OSError:
+      # deleter could have deleted, so skip
+      self._remove_file(segment, name)
+      return
+
+    segment.files[name] = SegmentFile(st.st_size, st.st_ctime, uploaded)
+    if uploaded:
+      self._discard_pending(segment, name)
+    elif name not in segment.pending:
+      segment.pending.add(name)
+      if len(segment.pending) == 1:
+        self._pending_by_creation = None
+
+  def _remove_file(self, segment: Segment, name: str) -> None:
+    segment.locks.discard(name)
+    segment.files.pop(name, None)
+    self._discard_pending(segment, name)
+
+  def _discard_pending(self, segment: Segment, name: str) -> None:
+    if name in segment.pending:
+      segment.pending.discard(name)
+      if len(segment.pending) == 0:
+        self._pending_by_creation = None
+
+  def _invalidate_order(self) -> None:
+    self._by_creation = None
+    self._pending_by_creation = None
@@ -9,24 +9,36 @@ import threading
 import time
 import traceback
 import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 from typing import BinaryIO
 from collections.abc import Iterator
 
 from cereal import log
 import cereal.messaging as messaging
 from openpilot.common.api import Api
+from openpilot.common.file_helpers import CallbackReader
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware.hw import Paths
-from openpilot.system.loggerd.xattr_cache import getxattr, setxattr
+from openpilot.system.loggerd.segment_catalog import UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE, SegmentCatalog, get_directory_sort
+from openpilot.system.loggerd.xattr_cache import setxattr
 from openpilot.common.swaglog import cloudlog
 
 NetworkType = log.DeviceState.NetworkType
-UPLOAD_ATTR_NAME = 'user.upload'
-UPLOAD_ATTR_VALUE = b'1'
 
 UPLOAD_QLOG_QCAM_MAX_SIZE = 5 * 1e6  # MB
 
+MAX_UPLOAD_WORKERS = int(os.getenv("UPLOADER_WORKERS", "4"))
+
+# bytes/s shared by all running uploads, None is unlimited
+BANDWIDTH_BUDGETS = {
+  NetworkType.cell2G: 10e3,
+  NetworkType.cell3G: 100e3,
+  NetworkType.cell4G: 1e6,
+  NetworkType.cell5G: 2.5e6,
+}
+
 allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
@@ -43,10 +55,45 @@ class FakeResponse:
     self.request = FakeRequest()
 
 
-def get_directory_sort(d: str) -> list[str]:
-  # ensure old format is sorted sooner
-  o = ["0", ] if d.startswith("2024-") else ["1", ]
-  return o + [s.rjust(10, '0') for s in d.rsplit('--', 1)]
+class BandwidthLimiter:
+  """Token bucket shared between the upload workers, readers go into debt and sleep it off."""
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.rate: float | None = None
+    self.available = 0.
+    self.last_refill = time.monotonic()
+
+  def set_rate(self, rate: float | None) -> None:
+    with self.lock:
+      if rate != self.rate:
+        self.rate = rate
+        self.available = 0.
+        self.last_refill = time.monotonic()
+
+  def consume(self, size: int) -> None:
+    with self.lock:
+      if self.rate is None:
+        return
+      now = time.monotonic()
+      self.available = min(self.rate, self.available + (now - self.last_refill) * self.rate)
+      self.last_refill = now
+      self.available -= size
+      wait = -self.available / self.rate
+
+    if wait > 0:
+      time.sleep(wait)
+
+
+class ThrottledReader(CallbackReader):
+  def __init__(self, f, limiter: BandwidthLimiter):
+    super().__init__(f, self.throttle)
+    self.limiter = limiter
+    self.consumed = 0
+
+  def throttle(self, total_read: int) -> None:
+    self.limiter.consume(total_read - self.consumed)
+    self.consumed = total_read
+
 
 def listdir_by_creation(d: str) -> list[str]:
   if not os.path.isdir(d):
@@ -76,6 +123,7 @@ class Uploader:
     self.dongle_id = dongle_id
     self.api = Api(dongle_id)
     self.root = root
+    self.catalog = SegmentCatalog(root)
 
     self.params = Params()
 
@@ -85,33 +133,32 @@ class Uploader:
     self.immediate_folders = ["crash/", "boot/"]
     self.immediate_priority = {"qlog": 0, "qlog.bz2": 0, "qcamera.ts": 1}
 
-  def list_upload_files(self, metered: bool) -> Iterator[tuple[str, str, str]]:
+    self.max_workers = MAX_UPLOAD_WORKERS
+    self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="uploader")
+    self.in_flight: dict[str, Future] = {}
+    self.limiter = BandwidthLimiter()
+
+  def close(self) -> None:
+    self.executor.shutdown(wait=True, cancel_futures=True)
+    self.catalog.close()
+
+  def list_upload_files(self, metered: bool, logdirs: list[str] = None) -> Iterator[tuple[str, str, str]]:
     r = self.params.get("AthenadRecentlyViewedRoutes", encoding="utf8")
     requested_routes = [] if r is None else r.split(",")
 
-    for logdir in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logdir)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
+    if logdirs is None:
+      logdirs = self.catalog.pending_by_creation()
 
-      if any(name.endswith(".lock") for name in names):
+    for logdir in logdirs:
+      segment = self.catalog.segments[logdir]
+      if segment.locked:
         continue
 
-      for name in sorted(names, key=lambda n: self.immediate_priority.get(n, 1000)):
+      path = os.path.join(self.root, logdir)
+      for name in sorted(segment.pending, key=lambda n: self.immediate_priority.get(n, 1000)):
         key = os.path.join(logdir, name)
         fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          ctime = os.path.getctime(fn)
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
-          # deleter could have deleted, so skip
-          continue
-        if is_uploaded:
-          continue
+        ctime = segment.files[name].ctime
 
         # limit uploading on metered connections
         if metered:
@@ -124,18 +171,25 @@ class Uploader:
 
         yield name, key, fn
 
-  def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
-    upload_files = list(self.list_upload_files(metered))
+  def upload_queue(self, metered: bool) -> Iterator[tuple[str, str, str]]:
+    """Files to upload, most important first: everything in the immediate folders, then the
+    immediate_priority files of each segment oldest first. Lazy, so taking the head is cheap."""
+    self.catalog.update()
 
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return name, key, fn
+    immediate_logdirs = [d for d in (f.rstrip("/") for f in self.immediate_folders) if d in self.catalog.segments]
+    yield from self.list_upload_files(metered, sorted(immediate_logdirs, key=get_directory_sort))
 
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return name, key, fn
+    for name, key, fn in self.list_upload_files(metered):
+      if name in self.immediate_priority and not any(f in fn for f in self.immediate_folders):
+        yield name, key, fn
 
-    return None
+  def next_files_to_upload(self, metered: bool, count: int) -> list[tuple[str, str, str]]:
+    upload_files = (f for f in self.upload_queue(metered) if f[2] not in self.in_flight)
+    return list(islice(upload_files, max(count, 0)))
+
+  def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
+    upload_files = self.next_files_to_upload(metered, 1)
+    return upload_files[0] if len(upload_files) else None
 
   def do_upload(self, key: str, fn: str):
     url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
@@ -158,7 +212,7 @@ class Uploader:
       else:
         data = f
 
-      return requests.put(url, data=data, headers=headers, timeout=10)
+      return requests.put(url, data=ThrottledReader(data, self.limiter), headers=headers, timeout=10)
 
   def upload(self, name: str, key: str, fn: str, network_type: int, metered: bool) -> bool:
     try:
@@ -211,17 +265,31 @@ class Uploader:
 
 
   def step(self, network_type: int, metered: bool) -> bool | None:
-    d = self.next_file_to_upload(metered)
-    if d is None:
-      return None
+    """Collects finished uploads and tops the worker pool back up. Returns None when there is nothing
+    to upload, False when an upload failed and True otherwise."""
+    finished = [fn for fn, future in self.in_flight.items() if future.done()]
+    results = [self.in_flight.pop(fn).result() for fn in finished]
+    failed = not all(results)
 
-    name, key, fn = d
+    self.limiter.set_rate(BANDWIDTH_BUDGETS.get(network_type))
 
-    # qlogs and bootlogs need to be compressed before uploading
-    if key.endswith(('qlog', 'rlog')) or (key.startswith('boot/') and not key.endswith('.bz2')):
-      key += ".bz2"
+    # only the qlog path runs on metered connections, one file at a time
+    workers = 1 if metered else self.max_workers
 
-    return self.upload(name, key, fn, network_type, metered)
+    # don't start new uploads after a failure, let the caller back off first
+    if not failed:
+      for name, key, fn in self.next_files_to_upload(metered, workers - len(self.in_flight)):
+        # qlogs and bootlogs need to be compressed before uploading
+        if key.endswith(('qlog', 'rlog')) or (key.startswith('boot/') and not key.endswith('.bz2')):
+          key += ".bz2"
+
+        self.in_flight[fn] = self.executor.submit(self.upload, name, key, fn, network_type, metered)
+
+    if failed:
+      return False
+    if len(results) == 0 and len(self.in_flight) == 0:
+      return None
+    return True
 
 
 def main(exit_event: threading.Event = None) -> None:
@@ -268,6 +336,8 @@ def main(exit_event: threading.Event = None) -> None:
     if allow_sleep:
       time.sleep(backoff + random.uniform(0, backoff))
 
+  uploader.close()
+
 
 if __name__ == "__main__":
   main()
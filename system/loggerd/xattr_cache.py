@@ -1,22 +1,85 @@
 import os
 import errno
+import threading
+import time
+from collections import OrderedDict
 
-_cached_attributes: dict[tuple, bytes | None] = {}
+MAX_CACHED_PATHS = 10000
+# without a stat from the caller, cached values are trusted this long before the file is stat'ed again
+REVALIDATE_INTERVAL = 10.  # seconds
+
+# path -> ((inode, mtime, ctime), last validated, {attr_name: value}), least recently used first
+_cached_attributes: OrderedDict[str, tuple[tuple[int, int, int], float, dict[str, bytes | None]]] = OrderedDict()
+_lock = threading.Lock()
+
+def _read_xattr(path: str, attr_name: str) -> bytes | None:
+  try:
+    return os.getxattr(path, attr_name)
+  except OSError as e:
+    # ENODATA means attribute hasn't been set
+    if e.errno == errno.ENODATA:
+      return None
+    raise
+
+def getxattr(path: str, attr_name: str, st: os.stat_result | None = None) -> bytes | None:
+  """Cached os.getxattr, None when the attribute isn't set or path doesn't exist.
+  Pass st when the caller already has a fresh stat of path to validate against it right away."""
+  now = time.monotonic()
+  if st is None:
+    with _lock:
+      entry = _cached_attributes.get(path)
+      if entry is not None and now - entry[1] < REVALIDATE_INTERVAL and attr_name in entry[2]:
+        _cached_attributes.move_to_end(path)
+        return entry[2][attr_name]
 
-def getxattr(path: str, attr_name: str) -> bytes | None:
-  key = (path, attr_name)
-  if key not in _cached_attributes:
     try:
-      response = os.getxattr(path, attr_name)
-    except OSError as e:
-      # ENODATA means attribute hasn't been set
-      if e.errno == errno.ENODATA:
-        response = None
-      else:
-        raise
-    _cached_attributes[key] = response
-  return _cached_attributes[key]
+      st = os.stat(path)
+    except OSError:
+      invalidate(path)
+      return None
+
+  # a recreated file gets a new inode, and setting an attribute from anywhere bumps ctime
+  version = (st.st_ino, st.st_mtime_ns, st.st_ctime_ns)
+
+  with _lock:
+    entry = _cached_attributes.get(path)
+    if entry is not None and entry[0] == version:
+      _cached_attributes[path] = entry = (version, now, entry[2])
+      _cached_attributes.move_to_end(path)
+      if attr_name in entry[2]:
+        return entry[2][attr_name]
+
+  try:
+    response = _read_xattr(path, attr_name)
+  except FileNotFoundError:
+    invalidate(path)
+    return None
+
+  with _lock:
+    entry = _cached_attributes.get(path)
+    if entry is None or entry[0] != version:
+      entry = (version, now, {})
+      _cached_attributes[path] = entry
+    entry[2][attr_name] = response
+    _cached_attributes.move_to_end(path)
+
+    while len(_cached_attributes) > MAX_CACHED_PATHS:
+      _cached_attributes.popitem(last=False)
+
+  return response
+
+def getxattr_many(paths: list[str], attr_name: str) -> list[bytes | None]:
+  """getxattr for each path, paths that no longer exist give None."""
+  return [getxattr(path, attr_name) for path in paths]
 
 def setxattr(path: str, attr_name: str, attr_value: bytes) -> None:
-  _cached_attributes.pop((path, attr_name), None)
+  invalidate(path)
   return os.setxattr(path, attr_name, attr_value)
+
+def invalidate(path: str | None = None) -> None:
+  """Drops the cached attributes of path, or everything when no path is given."""
+  with _lock:
+    if path is None:
+      _cached_attributes.clear()
+    else:
+      _cached_attributes.pop(path, None)
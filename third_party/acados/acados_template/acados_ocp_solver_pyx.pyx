@@ -298,6 +298,45 @@ cdef class AcadosOcpSolverCython:
         return out
 
 
+    def get_flat(self, str field_, out_=None):
+        """
+        Get the last solution of the solver for all stages in one call:
+
+            :param field: string in ['x', 'u', 'z', 'sl', 'su']
+            :param out: optional contiguous float64 array to write into, reused across calls to avoid allocations
+
+            The values of stage 0 to N are concatenated, stages where the field is empty contribute nothing.
+        """
+        out_fields = ['x', 'u', 'z', 'sl', 'su']
+        field = field_.encode('utf-8')
+
+        if field_ not in out_fields:
+            raise Exception('AcadosOcpSolverCython.get_flat(): {} is an invalid argument.\
+                    \n Possible values are {}.'.format(field_, out_fields))
+
+        cdef int stage
+        cdef int offset = 0
+        stage_dims = []
+        for stage in range(self.N + 1):
+            stage_dims.append(acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, stage, field))
+        total = sum(stage_dims)
+
+        if out_ is None:
+            out_ = np.zeros((total,))
+        if not (isinstance(out_, np.ndarray) and out_.dtype == np.float64 and out_.flags.c_contiguous and out_.size == total):
+            raise Exception(f'AcadosOcpSolverCython.get_flat(): out must be a contiguous float64 array of size {total}.')
+
+        cdef double[::1] out = out_.reshape(-1)
+        for stage in range(self.N + 1):
+            if stage_dims[stage] > 0:
+                acados_solver_common.ocp_nlp_out_get(self.nlp_config, \
+                    self.nlp_dims, self.nlp_out, stage, field, <void *> &out[offset])
+            offset += stage_dims[stage]
+
+        return out_
+
+
     def print_statistics(self):
         """
         prints statistics of previous solver run as a table:
@@ -587,6 +626,67 @@ cdef class AcadosOcpSolverCython:
                     self.nlp_solver, stage, field, <void *> value.data)
         return
 
+    def set_flat(self, str field_, value_):
+        """
+        Set numerical data of all stages in one call.
+
+            :param field: string in ['x', 'u', 'yref', 'p']
+            :param value: contiguous float64 array with the values of stage 0 to N concatenated
+
+            .. note:: stages where the field is smaller, e.g. yref at the terminal stage, take only as many values as their dimension. \n
+                      p has the same dimension at every stage.
+        """
+        if not isinstance(value_, np.ndarray):
+            raise Exception(f"set_flat: value must be numpy array, got {type(value_)}.")
+        out_fields = ['x', 'u']
+        cost_fields = ['yref']
+
+        field = field_.encode('utf-8')
+
+        cdef double[::1] value = np.ascontiguousarray(value_.reshape(-1), dtype=np.float64)
+        cdef int stage
+        cdef int offset = 0
+        cdef int dims[2]
+        cdef int np_stage
+
+        if field_ == 'p':
+            if value.shape[0] == 0 or value.shape[0] % (self.N + 1) != 0:
+                raise Exception('AcadosOcpSolverCython.set_flat(): p must have the same dimension at all {} stages, got {} values.'\
+                    .format(self.N + 1, value.shape[0]))
+            np_stage = value.shape[0] // (self.N + 1)
+            for stage in range(self.N + 1):
+                assert acados_solver.acados_update_params(self.capsule, stage, &value[stage * np_stage], np_stage) == 0
+            return
+
+        if field_ not in out_fields + cost_fields:
+            raise Exception("AcadosOcpSolverCython.set_flat(): {} is not a valid argument.\
+                \nPossible values are {}.".format(field_, out_fields + cost_fields + ['p']))
+
+        stage_dims = []
+        for stage in range(self.N + 1):
+            if field_ in cost_fields:
+                acados_solver_common.ocp_nlp_cost_dims_get_from_attr(self.nlp_config, \
+                    self.nlp_dims, self.nlp_out, stage, field, &dims[0])
+            else:
+                dims[0] = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                    self.nlp_dims, self.nlp_out, stage, field)
+            stage_dims.append(dims[0])
+
+        if value.shape[0] != sum(stage_dims):
+            raise Exception('AcadosOcpSolverCython.set_flat(): mismatching dimension for field "{}" with dimension {} (you have {})'\
+                .format(field_, sum(stage_dims), value.shape[0]))
+
+        for stage in range(self.N + 1):
+            if stage_dims[stage] > 0:
+                if field_ in cost_fields:
+                    acados_solver_common.ocp_nlp_cost_model_set(self.nlp_config,
+                        self.nlp_dims, self.nlp_in, stage, field, <void *> &value[offset])
+                else:
+                    acados_solver_common.ocp_nlp_out_set(self.nlp_config,
+                        self.nlp_dims, self.nlp_out, stage, field, <void *> &value[offset])
+            offset += stage_dims[stage]
+        return
+
     def cost_set(self, int stage, str field_, value_):
         """
         Set numerical data in the cost module of the solver.
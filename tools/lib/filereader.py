@@ -1,12 +1,28 @@
+import json
 import os
 import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
 from urllib.parse import urlparse
 
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.tools.lib.cache import DEFAULT_CACHE_DIR
 from openpilot.tools.lib.url_file import URLFile
 
 DATA_ENDPOINT = os.getenv("DATA_ENDPOINT", "http://data-raw.comma.internal/")
 
+# remote files that were found are remembered on disk for this long, missing ones are always checked again
+FILE_EXISTS_CACHE_TTL = int(os.getenv("FILE_EXISTS_CACHE_TTL", str(60 * 60)))
+FILE_EXISTS_CACHE_PATH = os.path.join(DEFAULT_CACHE_DIR, "file_exists.json")
+MAX_EXISTS_WORKERS = 32
 
+_file_exists_lock = threading.Lock()
+_file_exists_cache: dict[str, float] | None = None
+
+
+@cache
 def internal_source_available():
   try:
     hostname = urlparse(DATA_ENDPOINT).hostname
@@ -25,11 +41,63 @@ def resolve_name(fn):
   return fn
 
 
+def _cache_key(url):
+  # signed urls change on every request
+  return url.split("?")[0]
+
+
+def _load_file_exists_cache() -> dict[str, float]:
+  global _file_exists_cache
+  if _file_exists_cache is None:
+    try:
+      with open(FILE_EXISTS_CACHE_PATH) as f:
+        _file_exists_cache = json.load(f)
+    except (OSError, ValueError):
+      _file_exists_cache = {}
+  return _file_exists_cache
+
+
+def _save_file_exists_cache(exists_cache: dict[str, float]) -> None:
+  now = time.time()
+  os.makedirs(os.path.dirname(FILE_EXISTS_CACHE_PATH), exist_ok=True)
+  with atomic_write_in_dir(FILE_EXISTS_CACHE_PATH, mode="w", overwrite=True) as f:
+    json.dump({k: t for k, t in exists_cache.items() if now - t < FILE_EXISTS_CACHE_TTL}, f)
+
+
+def _url_exists(url):
+  return URLFile(url).get_length_online() != -1
+
+
+def files_exist(fns: list[str]) -> list[bool]:
+  """Checks all files at once, remote files are checked concurrently over the shared connection pool."""
+  fns = [resolve_name(fn) for fn in fns]
+  exists: dict[str, bool] = {fn: os.path.exists(fn) for fn in fns if not fn.startswith(("http://", "https://"))}
+
+  now = time.time()
+  with _file_exists_lock:
+    exists_cache = _load_file_exists_cache()
+    for fn in fns:
+      checked = exists_cache.get(_cache_key(fn))
+      if fn not in exists and checked is not None and now - checked < FILE_EXISTS_CACHE_TTL:
+        exists[fn] = True
+
+  urls = list(dict.fromkeys(fn for fn in fns if fn not in exists))
+  if len(urls):
+    with ThreadPoolExecutor(max_workers=min(len(urls), MAX_EXISTS_WORKERS)) as pool:
+      exists |= dict(zip(urls, pool.map(_url_exists, urls), strict=True))
+
+    found = [url for url in urls if exists[url]]
+    if len(found):
+      with _file_exists_lock:
+        exists_cache = _load_file_exists_cache()
+        exists_cache |= {_cache_key(url): now for url in found}
+        _save_file_exists_cache(exists_cache)
+
+  return [exists[fn] for fn in fns]
+
+
 def file_exists(fn):
-  fn = resolve_name(fn)
-  if fn.startswith(("http://", "https://")):
-    return URLFile(fn).get_length_online() != -1
-  return os.path.exists(fn)
+  return files_exist([fn])[0]
 
 
 def FileReader(fn, debug=False):
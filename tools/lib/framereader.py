@@ -1,33 +1,52 @@
+import functools
 import json
 import os
-import pickle
+import re
+import shutil
 import struct
 import subprocess
+import tempfile
 import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
-from functools import wraps
+from hashlib import sha256
 
 import numpy as np
 from lru import LRU
 
 import _io
-from openpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
+from openpilot.tools.lib.cache import DEFAULT_CACHE_DIR
 from openpilot.tools.lib.exceptions import DataUnreadableError
 from openpilot.tools.lib.vidindex import hevc_index
 from openpilot.common.file_helpers import atomic_write_in_dir
 
 from openpilot.tools.lib.filereader import FileReader, resolve_name
+from openpilot.tools.lib.url_file import ChunkCacheIndex
 
 HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# bump when the on-disk video index layout changes
+VIDEO_INDEX_VERSION = 1
+# bytes hashed from each end of a video for its content key
+CONTENT_KEY_SAMPLE_SIZE = 64 * 1024
+# decoded GOPs are only kept on disk when FRAMEREADER_GOP_CACHE is set, they are large
+GOP_CACHE_MAX_SIZE = int(os.getenv("FRAMEREADER_GOP_CACHE_SIZE", str(10 * 1000 * 1000 * 1000)))
+# <content key>_<first frame>_<pix_fmt>.npy
+GOP_NAME = re.compile(r"^[0-9a-f]{64}_\d+_\w+\.npy$")
+
 
 class GOPReader:
   def get_gop(self, num):
     # returns (start_frame_num, num_frames, frames_to_skip, gop_data)
     raise NotImplementedError
 
+  def get_gop_start(self, num):
+    # returns the first frame number of the GOP containing num, without reading it
+    raise NotImplementedError
+
 
 class DoNothingContextManager:
   def __enter__(self):
@@ -74,30 +93,57 @@ def ffprobe(fn, fmt=None):
   return json.loads(ffprobe_output)
 
 
-def cache_fn(func):
-  @wraps(func)
-  def cache_inner(fn, *args, **kwargs):
-    if kwargs.pop('no_cache', None):
-      cache_path = None
-    else:
-      cache_dir = kwargs.pop('cache_dir', DEFAULT_CACHE_DIR)
-      cache_path = cache_path_for_file_path(fn, cache_dir)
+def video_content_key(fn):
+  # the same video has the same key wherever it's read from, a changed file gets a new one
+  with FileReader(fn) as f:
+    length = f.get_length() if hasattr(f, "get_length") else os.fstat(f.fileno()).st_size
+    head = f.read(CONTENT_KEY_SAMPLE_SIZE)
+    f.seek(max(0, length - CONTENT_KEY_SAMPLE_SIZE))
+    tail = f.read(CONTENT_KEY_SAMPLE_SIZE)
 
-    if cache_path and os.path.exists(cache_path):
-      with open(cache_path, "rb") as cache_file:
-        cache_value = pickle.load(cache_file)
-    else:
-      cache_value = func(fn, *args, **kwargs)
-      if cache_path:
-        with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-          pickle.dump(cache_value, cache_file, -1)
+  return sha256(str(length).encode() + head + tail).hexdigest()
+
+
+def video_index_dir(content_key, cache_dir=DEFAULT_CACHE_DIR):
+  return os.path.join(cache_dir, "video_index", f"v{VIDEO_INDEX_VERSION}", content_key)
+
+
+def load_video_index(content_key, cache_dir=DEFAULT_CACHE_DIR):
+  index_dir = video_index_dir(content_key, cache_dir)
+  if not os.path.isdir(index_dir):
+    return None
+
+  # memory-mapped, so processes reading the same video share the index pages
+  with open(os.path.join(index_dir, "prefix.bin"), "rb") as f:
+    global_prefix = f.read()
+  with open(os.path.join(index_dir, "probe.json")) as f:
+    probe = json.load(f)
+
+  return {
+    'index': np.load(os.path.join(index_dir, "index.npy"), mmap_mode='r'),
+    'global_prefix': global_prefix,
+    'probe': probe,
+  }
 
-    return cache_value
 
-  return cache_inner
+def save_video_index(content_key, index_data, cache_dir=DEFAULT_CACHE_DIR):
+  index_dir = video_index_dir(content_key, cache_dir)
+  os.makedirs(os.path.dirname(index_dir), exist_ok=True)
+
+  tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(index_dir))
+  np.save(os.path.join(tmp_dir, "index.npy"), index_data['index'])
+  with open(os.path.join(tmp_dir, "prefix.bin"), "wb") as f:
+    f.write(index_data['global_prefix'])
+  with open(os.path.join(tmp_dir, "probe.json"), "w") as f:
+    json.dump(index_data['probe'], f)
+
+  try:
+    os.rename(tmp_dir, index_dir)
+  except OSError:
+    # another process stored the same index first
+    shutil.rmtree(tmp_dir)
 
 
-@cache_fn
 def index_stream(fn, ft):
   if ft != FrameType.h265_stream:
     raise NotImplementedError("Only h265 supported")
@@ -113,8 +159,40 @@ def index_stream(fn, ft):
   }
 
 
-def get_video_index(fn, frame_type, cache_dir=DEFAULT_CACHE_DIR):
-  return index_stream(fn, frame_type, cache_dir=cache_dir)
+def get_video_index(fn, frame_type, cache_dir=DEFAULT_CACHE_DIR, content_key=None):
+  content_key = content_key or video_content_key(fn)
+  index_data = load_video_index(content_key, cache_dir)
+  if index_data is None:
+    index_data = index_stream(fn, frame_type)
+    save_video_index(content_key, index_data, cache_dir)
+  return index_data
+
+
+class GOPCache:
+  """Size-bounded LRU of decoded GOPs on disk, shared by every reader of the same video."""
+  def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=GOP_CACHE_MAX_SIZE):
+    self.root = os.path.join(cache_dir, "gop_cache", f"v{VIDEO_INDEX_VERSION}")
+    os.makedirs(self.root, exist_ok=True)
+    self.index = ChunkCacheIndex(self.root, max_size, GOP_NAME)
+
+  @staticmethod
+  def _name(content_key, frame_b, pix_fmt):
+    return f"{content_key}_{frame_b}_{pix_fmt}.npy"
+
+  def get(self, content_key, frame_b, pix_fmt):
+    name = self._name(content_key, frame_b, pix_fmt)
+    try:
+      frames = np.load(os.path.join(self.root, name), mmap_mode='r')
+    except (FileNotFoundError, ValueError):
+      return None
+    self.index.touch([(name, frames.nbytes)])
+    return frames
+
+  def put(self, content_key, frame_b, pix_fmt, frames):
+    name = self._name(content_key, frame_b, pix_fmt)
+    with atomic_write_in_dir(os.path.join(self.root, name), mode="wb", overwrite=True) as f:
+      np.save(f, frames)
+    self.index.add(name, frames.nbytes)
 
 def read_file_check_size(f, sz, cookie):
   buff = bytearray(sz)
@@ -166,7 +244,102 @@ def rgb24tonv12(rgb):
   return nv12.clip(0, 255).astype('uint8')
 
 
+# pix_fmts that PyAV converts to the same layout as ffmpeg's rawvideo output for the yuv420p streams the cameras record,
+# with the bytes per row of each plane as a multiple of the frame width
+AV_PIX_FMTS = {"nv12": (1, 1), "yuv420p": (1, 0.5, 0.5), "rgb24": (3,)}
+
+DECODER_POOL_SIZE = int(os.getenv("FRAMEREADER_DECODERS", str(os.cpu_count() or 1)))
+
+_decoder_pool: ThreadPoolExecutor | None = None
+_decoder_pool_lock = threading.Lock()
+
+
+def decoder_pool():
+  # libav and ffmpeg subprocesses both decode without the GIL, so threads spread GOPs across cores
+  global _decoder_pool
+  with _decoder_pool_lock:
+    if _decoder_pool is None:
+      _decoder_pool = ThreadPoolExecutor(max_workers=DECODER_POOL_SIZE, thread_name_prefix="gop_decoder")
+    return _decoder_pool
+
+
+def _reset_decoder_pool():
+  global _decoder_pool, _decoder_pool_lock
+  _decoder_pool = None
+  _decoder_pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_decoder_pool)
+
+
+_av_decoders = threading.local()
+
+
+@functools.cache
+def _av_available():
+  try:
+    import av  # noqa: F401
+  except ImportError:
+    return False
+  return True
+
+
+def _av_decoder():
+  # one codec context per decoder thread, flushed between GOPs instead of created for each one
+  codec = getattr(_av_decoders, "codec", None)
+  if codec is None:
+    import av
+    codec = av.CodecContext.create("hevc", "r")
+    codec.options = {"flags2": "+showall"}
+    # parallelism comes from decoding several GOPs at once
+    codec.thread_count = 1
+    _av_decoders.codec = codec
+  return codec
+
+
+def _copy_av_frame(frame, out, w, pix_fmt):
+  # copies the planes straight into out, leaving out the padding at the end of each row
+  out = out.reshape(-1)
+  offset = 0
+  for plane, row_width in zip(frame.planes, AV_PIX_FMTS[pix_fmt], strict=True):
+    rows = np.frombuffer(plane, dtype=np.uint8).reshape(-1, plane.line_size)[:, :int(w * row_width)]
+    out[offset:offset + rows.size].reshape(rows.shape)[:] = rows
+    offset += rows.size
+
+
+def decompress_video_data_av(rawdat, w, h, pix_fmt):
+  """Decodes a GOP in process with libav, or returns None for streams that aren't yuv420p, which only ffmpeg converts as expected."""
+  codec = _av_decoder()
+  try:
+    # the hevc parser splits the GOP into one packet per frame
+    packets = codec.parse(rawdat) + codec.parse()
+    if pix_fmt == "rgb24":
+      ret = np.empty((len(packets), h, w, 3), dtype=np.uint8)
+    else:
+      ret = np.empty((len(packets), h*w*3//2), dtype=np.uint8)
+
+    n = 0
+    for packet in [*packets, None]:
+      for frame in codec.decode(packet):
+        if frame.format.name != "yuv420p":
+          return None
+        if n == len(ret):
+          ret = np.concatenate([ret, np.empty_like(ret[:1])])
+        _copy_av_frame(frame if pix_fmt == "yuv420p" else frame.reformat(format=pix_fmt), ret[n], w, pix_fmt)
+        n += 1
+    return ret[:n]
+  finally:
+    codec.flush_buffers()
+
+
 def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
+  # decode in process with libav when PyAV is installed, this skips spawning ffmpeg for every GOP. FRAMEREADER_AV=0 turns it off
+  use_av = os.getenv("FRAMEREADER_AV", "1") != "0" and os.getenv("FFMPEG_CUDA", "0") != "1"
+  if vid_fmt == "hevc" and pix_fmt in AV_PIX_FMTS and use_av and _av_available():
+    ret = decompress_video_data_av(rawdat, w, h, pix_fmt)
+    if ret is not None:
+      return ret
+
   threads = os.getenv("FFMPEG_THREADS", "0")
   cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
   args = ["ffmpeg", "-v", "quiet",
@@ -212,15 +385,23 @@ class BaseFrameReader:
   def get(self, num, count=1, pix_fmt="yuv420p"):
     raise NotImplementedError
 
+  def get_many(self, indices, pix_fmt="yuv420p"):
+    # returns the frames at indices as one contiguous (N, *frame_shape) array, e.g. (N, H, W, 3) for rgb24
+    return np.stack([self.get(num, pix_fmt=pix_fmt)[0] for num in indices])
+
 
 def FrameReader(fn, cache_dir=DEFAULT_CACHE_DIR, readahead=False, readbehind=False, index_data=None):
   frame_type = fingerprint_video(fn)
   if frame_type == FrameType.raw:
     return RawFrameReader(fn)
   elif frame_type in (FrameType.h265_stream,):
+    content_key = None
     if not index_data:
-      index_data = get_video_index(fn, frame_type, cache_dir)
-    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind)
+      content_key = video_content_key(fn)
+      index_data = get_video_index(fn, frame_type, cache_dir, content_key=content_key)
+    gop_cache = GOPCache(cache_dir) if int(os.getenv("FRAMEREADER_GOP_CACHE", "0")) else None
+    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind,
+                             gop_cache=gop_cache, content_key=content_key)
   else:
     raise NotImplementedError(frame_type)
 
@@ -386,6 +567,9 @@ class StreamGOPReader(GOPReader):
     self.w = probe['streams'][0]['width']
     self.h = probe['streams'][0]['height']
 
+  def get_gop_start(self, num):
+    return self._lookup_gop(num)[0]
+
   def _lookup_gop(self, num):
     frame_b = num
     while frame_b > 0 and self.index[frame_b, 0] != HEVC_SLICE_I:
@@ -470,32 +654,74 @@ class GOPFrameReader(BaseFrameReader):
       num, pix_fmt = self.readahead_last
 
       if self.readbehind:
-        for k in range(num - 1, max(0, num - self.readahead_len), -1):
-          self._get_one(k, pix_fmt)
+        self._get_many(range(num - 1, max(0, num - self.readahead_len), -1), pix_fmt)
       else:
-        for k in range(num, min(self.frame_count, num + self.readahead_len)):
-          self._get_one(k, pix_fmt)
+        self._get_many(range(num, min(self.frame_count, num + self.readahead_len)), pix_fmt)
+
+  def _get_many(self, nums, pix_fmt):
+    # returns the frames as one (N, *frame_shape) array, missing GOPs are decoded concurrently on the decoder pool
+    positions = defaultdict(list)
+    for pos, num in enumerate(nums):
+      positions[num].append(pos)
+
+    out = None
+    def put(num, frame):
+      nonlocal out
+      if out is None:
+        out = np.empty((len(nums), *frame.shape), dtype=frame.dtype)
+      for pos in positions[num]:
+        out[pos] = frame
 
-  def _get_one(self, num, pix_fmt):
-    assert num < self.frame_count
+    with self.cache_lock:
+      gops = defaultdict(list)
+      for num in positions:
+        if (num, pix_fmt) in self.frame_cache:
+          put(num, self.frame_cache[(num, pix_fmt)])
+        else:
+          gops[self.get_gop_start(num)].append(num)
 
-    if (num, pix_fmt) in self.frame_cache:
-      return self.frame_cache[(num, pix_fmt)]
+    # the lock isn't held while decoding, so cached frames can still be read in the meantime. a bounded number of
+    # GOPs is in flight, so random access over a whole video doesn't hold every decoded GOP in memory
+    pending = deque()
+    gop_nums = iter(gops.values())
+    while True:
+      while len(pending) < 2 * DECODER_POOL_SIZE and (nums_in_gop := next(gop_nums, None)) is not None:
+        pending.append((nums_in_gop, decoder_pool().submit(self._decode_gop, nums_in_gop[0], pix_fmt)))
+      if not pending:
+        break
 
-    with self.cache_lock:
-      if (num, pix_fmt) in self.frame_cache:
-        return self.frame_cache[(num, pix_fmt)]
+      nums_in_gop, decode = pending.popleft()
+      frame_b, gop_frames = decode.result()
+      with self.cache_lock:
+        for i in range(gop_frames.shape[0]):
+          self.frame_cache[(frame_b+i, pix_fmt)] = gop_frames[i]
+      for num in nums_in_gop:
+        put(num, gop_frames[num - frame_b])
 
-      frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+    if out is None:
+      return np.empty((0,), dtype=np.uint8)
+    return out
 
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
-      ret = ret[skip_frames:]
-      assert ret.shape[0] == num_frames
+  def get_many(self, indices, pix_fmt="yuv420p"):
+    assert self.frame_count is not None
 
-      for i in range(ret.shape[0]):
-        self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
+    nums = [int(num) for num in indices]
+    if any(not 0 <= num < self.frame_count for num in nums):
+      raise ValueError(f"frame indices must be in [0, {self.frame_count})")
 
-      return self.frame_cache[(num, pix_fmt)]
+    if pix_fmt not in ("nv12", "yuv420p", "rgb24", "yuv444p"):
+      raise ValueError(f"Unsupported pixel format {pix_fmt!r}")
+
+    return self._get_many(nums, pix_fmt)
+
+  def _decode_gop(self, num, pix_fmt):
+    # returns (start_frame_num, frames) for the GOP containing num
+    frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+
+    ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
+    ret = ret[skip_frames:]
+    assert ret.shape[0] == num_frames
+    return frame_b, ret
 
   def get(self, num, count=1, pix_fmt="yuv420p"):
     assert self.frame_count is not None
@@ -506,7 +732,7 @@ class GOPFrameReader(BaseFrameReader):
     if pix_fmt not in ("nv12", "yuv420p", "rgb24", "yuv444p"):
       raise ValueError(f"Unsupported pixel format {pix_fmt!r}")
 
-    ret = [self._get_one(num + i, pix_fmt) for i in range(count)]
+    ret = list(self._get_many(range(num, num + count), pix_fmt))
 
     if self.readahead:
       self.readahead_last = (num+count, pix_fmt)
@@ -518,10 +744,30 @@ class GOPFrameReader(BaseFrameReader):
 
 
 class StreamFrameReader(StreamGOPReader, GOPFrameReader):
-  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False):
+  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False, gop_cache=None, content_key=None):
     StreamGOPReader.__init__(self, fn, frame_type, index_data)
     GOPFrameReader.__init__(self, readahead, readbehind)
 
+    self.gop_cache = gop_cache
+    if content_key is not None:
+      self.content_key = content_key
+
+  @functools.cached_property
+  def content_key(self):
+    # only the GOP cache needs it, so a remote video isn't sampled for it otherwise
+    return video_content_key(self.fn)
+
+  def _decode_gop(self, num, pix_fmt):
+    if self.gop_cache is None or num < self.first_iframe:
+      return GOPFrameReader._decode_gop(self, num, pix_fmt)
+
+    frame_b, _, _, _ = self._lookup_gop(num)
+    frames = self.gop_cache.get(self.content_key, frame_b, pix_fmt)
+    if frames is None:
+      frame_b, frames = GOPFrameReader._decode_gop(self, num, pix_fmt)
+      self.gop_cache.put(self.content_key, frame_b, pix_fmt, frames)
+    return frame_b, frames
+
 
 def GOPFrameIterator(gop_reader, pix_fmt):
   dec = VideoStreamDecompressor(gop_reader.fn, gop_reader.vid_fmt, gop_reader.w, gop_reader.h, pix_fmt)
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 import bz2
-from functools import partial
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, reduce
 import multiprocessing
 import capnp
 import enum
+import hashlib
+import numpy as np
 import os
 import pathlib
+import struct
 import sys
 import tqdm
 import urllib.parse
@@ -15,57 +20,395 @@ from collections.abc import Callable, Iterable, Iterator
 from urllib.parse import parse_qs, urlparse
 
 from cereal import log as capnp_log
+from openpilot.common.file_helpers import atomic_write_in_dir
 from openpilot.common.swaglog import cloudlog
+from openpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
 from openpilot.tools.lib.comma_car_segments import get_url as get_comma_segments_url
 from openpilot.tools.lib.openpilotci import get_url
-from openpilot.tools.lib.filereader import FileReader, file_exists, internal_source_available
+from openpilot.tools.lib.filereader import FileReader, file_exists, files_exist, internal_source_available, resolve_name
 from openpilot.tools.lib.route import Route, SegmentRange
+from openpilot.tools.lib.url_file import URLFile
 
 LogMessage = type[capnp._DynamicStructReader]
 LogIterable = Iterable[LogMessage]
 RawLogIterable = Iterable[bytes]
 
 
+# bump when the on-disk index layout changes
+EVENT_INDEX_VERSION = 2
+EVENT_INDEX_DTYPE = np.dtype([('offset', np.uint64), ('size', np.uint32), ('mono_time', np.uint64), ('which', np.uint16)])
+UNKNOWN_UNION_TYPE = np.iinfo(np.uint16).max
+NO_TRAVERSAL_LIMIT = 2**64-1
+
+BZ2_MAGIC = b'BZh'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+LOG_EXTENSIONS = ('', '.bz2', '.zst')
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def _capnp_message_size(dat, offset: int) -> int:
+  # capnp stream framing: segment count - 1, then the size of each segment in words, padded to a word boundary
+  num_segments = struct.unpack_from("<I", dat, offset)[0] + 1
+  header_size = (4 * (num_segments + 1) + 7) & ~7
+  segment_words = struct.unpack_from(f"<{num_segments}I", dat, offset + 4)
+  return header_size + 8 * sum(segment_words)
+
+
+def _zstd_decompressor():
+  # only needed for re-encoded archives, the logs on the device are bz2
+  import zstandard
+  return zstandard.ZstdDecompressor().decompressobj()
+
+
+def decompress_log(dat: bytes, ext: str | None = None) -> bytes:
+  if ext == ".bz2" or dat.startswith(BZ2_MAGIC):
+    return bz2.decompress(dat)
+  elif ext == ".zst" or dat.startswith(ZSTD_MAGIC):
+    return b"".join(_iter_decompressed([dat], ext))
+  return dat
+
+
+def _iter_decompressed(chunks: Iterable[bytes], ext: str | None = None) -> Iterator[bytes]:
+  decompressor = None
+  for chunk in chunks:
+    if decompressor is None:
+      if ext == ".bz2" or chunk.startswith(BZ2_MAGIC):
+        decompressor = bz2.BZ2Decompressor()
+      elif ext == ".zst" or chunk.startswith(ZSTD_MAGIC):
+        decompressor = _zstd_decompressor()
+      else:
+        # old rlogs weren't compressed
+        decompressor = False
+
+    if decompressor is False:
+      yield chunk
+      continue
+
+    while chunk:
+      yield decompressor.decompress(chunk)
+      chunk = b""
+      # bz2 files can be several concatenated streams
+      if isinstance(decompressor, bz2.BZ2Decompressor) and decompressor.eof:
+        chunk = decompressor.unused_data
+        decompressor = bz2.BZ2Decompressor()
+
+
+def _iter_event_bytes(chunks: Iterable[bytes]) -> Iterator[bytes]:
+  buf = bytearray()
+  for chunk in chunks:
+    buf += chunk
+    offset = 0
+    while True:
+      try:
+        size = _capnp_message_size(buf, offset)
+      except struct.error:
+        break
+      if offset + size > len(buf):
+        break
+      yield bytes(buf[offset:offset + size])
+      offset += size
+    del buf[:offset]
+
+  if len(buf):
+    warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+
+def _read_events(dat) -> Iterator[capnp._DynamicStructReader]:
+  # the readers keep a reference to dat, so events stay valid without copying them out of the log
+  return capnp_log.Event.read_multiple_bytes(dat, traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
+
+
+def _decode_event(dat: memoryview, offset: int, size: int) -> capnp._DynamicStructReader:
+  return next(iter(_read_events(dat[offset:offset + size])))
+
+
+def _iter_frames(dat) -> Iterator[tuple[int, int]]:
+  offset = 0
+  while offset < len(dat):
+    size = _capnp_message_size(dat, offset)
+    if offset + size > len(dat):
+      raise EOFError
+    yield offset, size
+    offset += size
+
+
+def build_event_index(dat) -> tuple[np.ndarray, list[str]]:
+  """Walks the capnp framing of a decompressed log once, returning (offset, size, logMonoTime, union type) for every event."""
+  union_types = list(capnp_log.Event.schema.union_fields)
+  union_type_idx = {name: i for i, name in enumerate(union_types)}
+
+  entries = []
+  try:
+    for (offset, size), evt in zip(_iter_frames(dat), _read_events(dat), strict=False):
+      try:
+        which = union_type_idx.get(evt.which(), UNKNOWN_UNION_TYPE)
+      except capnp.KjException:
+        which = UNKNOWN_UNION_TYPE
+      entries.append((offset, size, evt.logMonoTime, which))
+  except (struct.error, EOFError, capnp.KjException):
+    warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  return np.array(entries, dtype=EVENT_INDEX_DTYPE), union_types
+
+
+def event_index_path(fn: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+  return cache_path_for_file_path(fn, cache_dir) + ".evtidx"
+
+
+def log_digest(dat) -> str:
+  # the index is only reused for the exact same log, hashing is cheap next to decompressing it
+  return hashlib.blake2b(dat, digest_size=16).hexdigest()
+
+
+def load_event_index(fn: str, digest: str, cache_dir: str = DEFAULT_CACHE_DIR) -> tuple[np.ndarray, list[str]] | None:
+  path = event_index_path(fn, cache_dir)
+  if not os.path.exists(path):
+    return None
+
+  try:
+    with np.load(path, allow_pickle=False) as cached:
+      if int(cached['version']) != EVENT_INDEX_VERSION or str(cached['digest']) != digest:
+        return None
+      return cached['index'], cached['union_types'].tolist()
+  except (OSError, KeyError, ValueError):
+    return None
+
+
+def save_event_index(fn: str, digest: str, index: np.ndarray, union_types: list[str], cache_dir: str = DEFAULT_CACHE_DIR) -> None:
+  with atomic_write_in_dir(event_index_path(fn, cache_dir), mode="wb", overwrite=True) as f:
+    np.savez(f, version=EVENT_INDEX_VERSION, digest=digest, index=index, union_types=np.array(union_types))
+
+
+def _log_extension(fn: str) -> str:
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  if ext not in LOG_EXTENSIONS:
+    # old rlogs weren't bz2 compressed
+    raise Exception(f"unknown extension {ext}")
+  return ext
+
+
 class _LogFileReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None, cache=False, cache_dir=DEFAULT_CACHE_DIR):
     self.data_version = None
     self._only_union_types = only_union_types
 
     ext = None
     if not dat:
-      _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-      if ext not in ('', '.bz2'):
-        # old rlogs weren't bz2 compressed
-        raise Exception(f"unknown extension {ext}")
-
+      ext = _log_extension(fn)
       with FileReader(fn) as f:
         dat = f.read()
 
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
-      dat = bz2.decompress(dat)
+    self._digest = log_digest(dat) if cache and fn else None
+    self._sort_by_time = sort_by_time
 
-    ents = capnp_log.Event.read_multiple_bytes(dat)
+    self._dat = memoryview(decompress_log(dat, ext))
+    self._index: np.ndarray | None = None
+    self._union_types: list[str] = []
 
-    _ents = []
+    # with cache, the index is persisted next to the other cached files
+    if self._digest is not None:
+      cached = load_event_index(fn, self._digest, cache_dir)
+      if cached is not None:
+        self._set_index(*cached)
+      else:
+        self._build_index()
+        save_event_index(fn, self._digest, self._index, self._union_types, cache_dir)
+
+  def _set_index(self, index: np.ndarray, union_types: list[str]) -> None:
+    if self._sort_by_time:
+      index = index[np.argsort(index['mono_time'], kind='stable')]
+    self._index = index
+    self._union_types = union_types
+
+  def _build_index(self) -> np.ndarray:
+    # only built once messages are filtered or sorted, a plain iteration decodes the log in one pass
+    if self._index is None:
+      self._set_index(*build_event_index(self._dat))
+    return self._index
+
+  def __len__(self) -> int:
+    return len(self._build_index())
+
+  def _select(self, msg_types: Iterable[str] | None = None, start_time: int | None = None, end_time: int | None = None) -> np.ndarray:
+    index = self._build_index()
+    mask = np.ones(len(index), dtype=bool)
+    if self._only_union_types:
+      mask &= index['which'] != UNKNOWN_UNION_TYPE
+    if msg_types is not None:
+      msg_types = set(msg_types)
+      type_idxs = [i for i, name in enumerate(self._union_types) if name in msg_types]
+      mask &= np.isin(index['which'], type_idxs)
+    if start_time is not None:
+      mask &= index['mono_time'] >= start_time
+    if end_time is not None:
+      mask &= index['mono_time'] < end_time
+    return index[mask]
+
+  def _iter_all(self) -> Iterator[capnp._DynamicStructReader]:
     try:
-      for e in ents:
-        _ents.append(e)
+      for evt in _read_events(self._dat):
+        if self._only_union_types:
+          try:
+            evt.which()
+          except capnp.KjException:
+            continue
+        yield evt
     except capnp.KjException:
       warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
 
-    self._ents = list(sorted(_ents, key=lambda x: x.logMonoTime) if sort_by_time else _ents)
-    self._ts = [x.logMonoTime for x in self._ents]
+  def select(self, msg_types: Iterable[str] | None = None, start_time: int | None = None,
+             end_time: int | None = None) -> Iterator[capnp._DynamicStructReader]:
+    """Yields only the events of the given union types within [start_time, end_time), without decoding the rest."""
+    if msg_types is None and start_time is None and end_time is None and not self._sort_by_time:
+      yield from self._iter_all()
+      return
+
+    selected = self._select(msg_types, start_time, end_time)
+    for offset, size in zip(selected['offset'].tolist(), selected['size'].tolist(), strict=True):
+      yield _decode_event(self._dat, offset, size)
 
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
-      if self._only_union_types:
-        try:
-          ent.which()
-          yield ent
-        except capnp.lib.capnp.KjException:
-          pass
-      else:
-        yield ent
+    yield from self.select()
+
+
+class _StreamLogFileReader:
+  """Decodes events straight off an incremental decompressor, so the whole log is never held in memory."""
+  def __init__(self, fn, only_union_types=False, chunk_size=STREAM_CHUNK_SIZE):
+    self.fn = fn
+    self._ext = _log_extension(fn)
+    self._only_union_types = only_union_types
+    self._chunk_size = chunk_size
+
+  def _read_chunks(self) -> Iterator[bytes]:
+    with FileReader(self.fn) as f:
+      while chunk := f.read(self._chunk_size):
+        yield chunk
+
+  def select(self, msg_types: Iterable[str] | None = None, start_time: int | None = None,
+             end_time: int | None = None) -> Iterator[capnp._DynamicStructReader]:
+    msg_types = set(msg_types) if msg_types is not None else None
+    try:
+      for dat in _iter_event_bytes(_iter_decompressed(self._read_chunks(), self._ext)):
+        evt = next(iter(_read_events(dat)))
+        if (start_time is not None and evt.logMonoTime < start_time) or (end_time is not None and evt.logMonoTime >= end_time):
+          continue
+
+        if self._only_union_types or msg_types is not None:
+          try:
+            which = evt.which()
+          except capnp.KjException:
+            continue
+          if msg_types is not None and which not in msg_types:
+            continue
+        yield evt
+    except capnp.KjException:
+      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
+    yield from self.select()
+
+
+ColumnSpec = dict[str, list[str]]
+Columns = dict[str, dict[str, np.ndarray]]
+
+# capnp field types that can be stored as a column, enums are stored as their raw values
+COLUMN_DTYPES = {
+  'bool': np.bool_, 'int8': np.int8, 'int16': np.int16, 'int32': np.int32, 'int64': np.int64,
+  'uint8': np.uint8, 'uint16': np.uint16, 'uint32': np.uint32, 'uint64': np.uint64,
+  'float32': np.float32, 'float64': np.float64, 'enum': np.uint16,
+}
+# bump when the way columns are stored changes
+COLUMNS_CACHE_VERSION = 1
+
+
+def _get_field(msg, field: str):
+  # nested fields are separated by dots, e.g. "actuators.accel"
+  return reduce(getattr, field.split("."), msg)
+
+
+def _field_type(service: str, field: str) -> str:
+  schema = capnp_log.Event.schema.fields[service].schema
+  *groups, name = field.split(".")
+  for group in groups:
+    schema = schema.fields[group].schema
+  proto = schema.fields[name].proto
+  return proto.slot.type.which() if proto.which() == 'slot' else proto.which()
+
+
+def column_dtype(service: str, field: str) -> np.dtype:
+  if field == "logMonoTime":
+    return np.dtype(np.uint64)
+
+  field_type = _field_type(service, field)
+  if field_type not in COLUMN_DTYPES:
+    raise ValueError(f"{service}.{field} is a {field_type} field, only scalar and enum fields can be extracted as columns")
+  return np.dtype(COLUMN_DTYPES[field_type])
+
+
+def extract_columns(lr: _LogFileReader | _StreamLogFileReader, services: ColumnSpec) -> Columns:
+  """Collects the given scalar fields of each service into arrays, sorted by logMonoTime."""
+  dtypes = {service: {field: column_dtype(service, field) for field in ["logMonoTime", *fields]} for service, fields in services.items()}
+  enums = {service: {field for field in fields if _field_type(service, field) == 'enum'} for service, fields in services.items()}
+
+  rows: dict[str, dict[str, list]] = {service: {field: [] for field in svc_dtypes} for service, svc_dtypes in dtypes.items()}
+  for msg in lr.select(services.keys()):
+    service = msg.which()
+    svc_msg = getattr(msg, service)
+    svc_rows = rows[service]
+    svc_rows["logMonoTime"].append(msg.logMonoTime)
+    for field in services[service]:
+      value = _get_field(svc_msg, field)
+      svc_rows[field].append(value.raw if field in enums[service] else value)
+
+  columns = {}
+  for service, svc_rows in rows.items():
+    mono_times = np.array(svc_rows["logMonoTime"], dtype=np.uint64)
+    order = np.argsort(mono_times, kind='stable')
+    columns[service] = {field: np.array(values, dtype=dtypes[service][field])[order] for field, values in svc_rows.items()}
+  return columns
+
+
+def columns_cache_path(fn: str, service: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+  return cache_path_for_file_path(fn, cache_dir) + f".{service}.parquet"
+
+
+def log_file_stamp(fn: str) -> str:
+  """Identifies the contents of a log without reading it, size and mtime for local files and the length for remote ones."""
+  fn = resolve_name(fn)
+  if fn.startswith(("http://", "https://")):
+    return f"{COLUMNS_CACHE_VERSION}:{URLFile(fn).get_length()}"
+  st = os.stat(fn)
+  return f"{COLUMNS_CACHE_VERSION}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def extract_columns_cached(get_lr: Callable[[], _LogFileReader | _StreamLogFileReader], fn: str, services: ColumnSpec,
+                           cache_dir: str = DEFAULT_CACHE_DIR) -> Columns:
+  """Like extract_columns, but keeps a parquet file per segment and service, so only fields that weren't requested before are read from the log."""
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+
+  stamp = log_file_stamp(fn).encode()
+  cached: dict[str, dict[str, np.ndarray]] = {}
+  missing: ColumnSpec = {}
+  for service, fields in services.items():
+    path = columns_cache_path(fn, service, cache_dir)
+    cached[service] = {}
+    if os.path.exists(path):
+      table = pq.read_table(path)
+      # the log was rewritten since the columns were cached
+      if (table.schema.metadata or {}).get(b"log_stamp") == stamp:
+        cached[service] = {name: table.column(name).to_numpy() for name in table.column_names}
+    if any(field not in cached[service] for field in fields):
+      missing[service] = [field for field in fields if field not in cached[service]]
+
+  if missing:
+    for service, new_columns in extract_columns(get_lr(), missing).items():
+      cached[service] |= new_columns
+      table = pa.table(cached[service]).replace_schema_metadata({b"log_stamp": stamp})
+      with atomic_write_in_dir(columns_cache_path(fn, service, cache_dir), mode="wb", overwrite=True) as f:
+        pq.write_table(table, f)
+
+  return {service: {field: cached[service][field] for field in ["logMonoTime", *fields]} for service, fields in services.items()}
 
 
 class ReadMode(enum.StrEnum):
@@ -87,6 +430,10 @@ def default_valid_file(fn: LogPath) -> bool:
   return fn is not None and file_exists(fn)
 
 
+def _file_checked(exists: dict[str, bool], fn: LogPath) -> bool:
+  return fn is not None and exists[fn]
+
+
 def auto_strategy(rlog_paths: LogPaths, qlog_paths: LogPaths, interactive: bool, valid_file: ValidFileCallable) -> LogPaths:
   # auto select logs based on availability
   if any(rlog is None or not valid_file(rlog) for rlog in rlog_paths) and all(qlog is not None and valid_file(qlog) for qlog in qlog_paths):
@@ -102,6 +449,11 @@ def auto_strategy(rlog_paths: LogPaths, qlog_paths: LogPaths, interactive: bool,
 
 
 def apply_strategy(mode: ReadMode, rlog_paths: LogPaths, qlog_paths: LogPaths, valid_file: ValidFileCallable = default_valid_file) -> LogPaths:
+  if valid_file is default_valid_file and mode in (ReadMode.AUTO, ReadMode.AUTO_INTERACTIVE):
+    # check all files concurrently up front, the strategy then only looks up the results, missing files included
+    fns = [fn for fn in rlog_paths + qlog_paths if fn is not None]
+    valid_file = partial(_file_checked, dict(zip(fns, files_exist(fns), strict=True)))
+
   if mode == ReadMode.RLOG:
     return rlog_paths
   elif mode == ReadMode.QLOG:
@@ -155,8 +507,10 @@ def direct_source(file_or_url: str) -> LogPaths:
 
 
 def get_invalid_files(files):
+  files = list(files)
+  exists = iter(files_exist([f for f in files if f is not None]))
   for f in files:
-    if f is None or not file_exists(f):
+    if f is None or not next(exists):
       yield f
 
 
@@ -166,27 +520,47 @@ def check_source(source: Source, *args) -> LogPaths:
   return files
 
 
+def race_sources(sources: list[Source], sr: SegmentRange, mode: ReadMode, parallel: bool = True) -> tuple[LogPaths | None, list[Exception]]:
+  """Probes all sources at once, returning the files of the first valid source in priority order."""
+  exceptions = []
+  if not parallel:
+    for source in sources:
+      try:
+        return check_source(source, sr, mode), exceptions
+      except Exception as e:
+        exceptions.append(e)
+    return None, exceptions
+
+  pool = ThreadPoolExecutor(max_workers=len(sources))
+  try:
+    futures = [pool.submit(check_source, source, sr, mode) for source in sources]
+    for future in futures:
+      try:
+        return future.result(), exceptions
+      except Exception as e:
+        exceptions.append(e)
+    return None, exceptions
+  finally:
+    # lower priority sources may still be probing, don't wait for them
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
 def auto_source(sr: SegmentRange, mode=ReadMode.RLOG) -> LogPaths:
   if mode == ReadMode.SANITIZED:
     return comma_car_segments_source(sr, mode)
 
   SOURCES: list[Source] = [internal_source, openpilotci_source, comma_api_source, comma_car_segments_source,]
-  exceptions = []
 
   # for automatic fallback modes, auto_source needs to first check if rlogs exist for any source
   if mode in [ReadMode.AUTO, ReadMode.AUTO_INTERACTIVE]:
-    for source in SOURCES:
-      try:
-        return check_source(source, sr, ReadMode.RLOG)
-      except Exception:
-        pass
+    files, _ = race_sources(SOURCES, sr, ReadMode.RLOG)
+    if files is not None:
+      return files
 
-  # Automatically determine viable source
-  for source in SOURCES:
-    try:
-      return check_source(source, sr, mode)
-    except Exception as e:
-      exceptions.append(e)
+  # Automatically determine viable source, the interactive fallback prompts so those are checked one at a time
+  files, exceptions = race_sources(SOURCES, sr, mode, parallel=mode != ReadMode.AUTO_INTERACTIVE)
+  if files is not None:
+    return files
 
   raise Exception(f"auto_source could not find any valid source, exceptions for sources: {exceptions}")
 
@@ -244,25 +618,63 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               default_source=auto_source, sort_by_time=False, only_union_types=False):
+               default_source=auto_source, sort_by_time=False, only_union_types=False, streaming=False, prefetch=0,
+               cache: bool | None = None, cache_dir: str = DEFAULT_CACHE_DIR):
+    assert not (streaming and sort_by_time), "sort_by_time needs the whole segment, it can't be used with streaming"
     self.default_mode = default_mode
     self.default_source = default_source
     self.identifier = identifier
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
-
-    self.__lrs: dict[int, _LogFileReader] = {}
+    self.streaming = streaming
+    # number of segments downloaded and parsed in the background, counting the one that is read next
+    self.prefetch = prefetch
+    # event indexes are only persisted when asked for, like URLFile's download cache
+    self.cache = bool(int(os.getenv("FILEREADER_CACHE", "0"))) if cache is None else cache
+    self.cache_dir = cache_dir
+
+    self.__lrs: dict[int, _LogFileReader | _StreamLogFileReader] = {}
     self.reset()
 
+  def _create_lr(self, i):
+    if self.streaming:
+      return _StreamLogFileReader(self.logreader_identifiers[i], only_union_types=self.only_union_types)
+    return _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types,
+                          cache=self.cache, cache_dir=self.cache_dir)
+
   def _get_lr(self, i):
     if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+      self.__lrs[i] = self._create_lr(i)
     return self.__lrs[i]
 
+  def _load_lr(self, i):
+    return self.__lrs[i] if i in self.__lrs else self._create_lr(i)
+
+  def _iter_lrs(self):
+    num_segs = len(self.logreader_identifiers)
+    if self.prefetch <= 0:
+      for i in range(num_segs):
+        yield self._get_lr(i)
+      return
+
+    # prefetched segments aren't kept around, so at most prefetch + 1 segments are in memory at once.
+    # downloading and bz2 decompression release the GIL, so threads are enough to overlap them with the consumer
+    pool = ThreadPoolExecutor(max_workers=self.prefetch)
+    try:
+      pending = deque()
+      next_seg = 0
+      while pending or next_seg < num_segs:
+        while next_seg < num_segs and len(pending) < self.prefetch:
+          pending.append(pool.submit(self._load_lr, next_seg))
+          next_seg += 1
+        yield pending.popleft().result()
+    finally:
+      pool.shutdown(wait=False, cancel_futures=True)
+
   def __iter__(self):
-    for i in range(len(self.logreader_identifiers)):
-      yield from self._get_lr(i)
+    for lr in self._iter_lrs():
+      yield from lr
 
   def _run_on_segment(self, func, i):
     return func(self._get_lr(i))
@@ -282,12 +694,37 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
   def from_bytes(dat):
     return _LogFileReader("", dat=dat)
 
+  def select(self, msg_types: Iterable[str] | None = None, start_time: int | None = None, end_time: int | None = None):
+    for lr in self._iter_lrs():
+      yield from lr.select(msg_types, start_time, end_time)
+
   def filter(self, msg_type: str):
-    return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
+    return (getattr(m, msg_type) for m in self.select([msg_type]))
 
   def first(self, msg_type: str):
     return next(self.filter(msg_type), None)
 
+  def to_columns(self, services: ColumnSpec, cache: bool = False, cache_dir: str = DEFAULT_CACHE_DIR) -> Columns:
+    """
+    Returns {service: {field: array}} with a logMonoTime array per service, e.g.
+    lr.to_columns({"carState": ["vEgo", "aEgo"], "controlsState": ["lateralControlState.torqueState.output"]})
+
+    Enums are returned as their raw values, list and struct fields can't be extracted.
+    With cache=True, the columns of every segment are stored as parquet files (needs pyarrow),
+    so repeated queries load arrays instead of walking the logs. A cached segment is read again once its log changes.
+    """
+    # segments aren't kept around, each one is dropped once its columns are extracted
+    if cache:
+      segments = [extract_columns_cached(partial(self._load_lr, i), fn, services, cache_dir) for i, fn in enumerate(self.logreader_identifiers)]
+    else:
+      lrs = self._iter_lrs() if self.prefetch > 0 else (self._load_lr(i) for i in range(len(self.logreader_identifiers)))
+      segments = [extract_columns(lr, services) for lr in lrs]
+
+    if not segments:
+      return {service: {field: np.array([], dtype=column_dtype(service, field)) for field in ["logMonoTime", *fields]} for service, fields in services.items()}
+    return {service: {field: np.concatenate([seg[service][field] for seg in segments]) for field in ["logMonoTime", *fields]}
+            for service, fields in services.items()}
+
 
 if __name__ == "__main__":
   import codecs
@@ -0,0 +1,160 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from openpilot.tools.lib import framereader
+
+# not a multiple of libav's line alignment, so decoded rows are padded
+W, H = 136, 96
+
+
+def encode_gop(pix_fmt, num_frames=20, pattern="testsrc", keyint=None):
+  if shutil.which("ffmpeg") is None:
+    pytest.skip("ffmpeg not installed")
+  return subprocess.check_output(["ffmpeg", "-v", "quiet", "-f", "lavfi", "-i", f"{pattern}=size={W}x{H}:rate=20", "-frames:v", str(num_frames),
+                                  "-pix_fmt", pix_fmt, "-c:v", "libx265", "-x265-params", f"log-level=none:keyint={keyint or num_frames}", "-f", "hevc", "-"])
+
+
+def decode(rawdat, pix_fmt, monkeypatch, av):
+  monkeypatch.setenv("FRAMEREADER_AV", "1" if av else "0")
+  return framereader.decompress_video_data(rawdat, "hevc", W, H, pix_fmt)
+
+
+@pytest.mark.parametrize("pix_fmt", framereader.AV_PIX_FMTS)
+def test_av_decode_matches_ffmpeg(pix_fmt, monkeypatch):
+  pytest.importorskip("av")
+  gops = [encode_gop("yuv420p"), encode_gop("yuv420p", num_frames=7, pattern="smptebars")]
+
+  expected = [decode(gop, pix_fmt, monkeypatch, av=False) for gop in gops]
+  assert [len(frames) for frames in expected] == [20, 7]
+  # the decoder is reused for every GOP on a thread
+  for _ in range(2):
+    for gop, expected_frames in zip(gops, expected, strict=True):
+      frames = decode(gop, pix_fmt, monkeypatch, av=True)
+      assert frames.shape == expected_frames.shape
+      np.testing.assert_array_equal(frames, expected_frames)
+
+
+def test_av_decode_falls_back_to_ffmpeg(monkeypatch):
+  pytest.importorskip("av")
+  gop = encode_gop("gbrp")
+
+  assert framereader.decompress_video_data_av(gop, W, H, "rgb24") is None
+  np.testing.assert_array_equal(decode(gop, "rgb24", monkeypatch, av=True), decode(gop, "rgb24", monkeypatch, av=False))
+
+
+def test_decoder_pool_is_shared(monkeypatch):
+  monkeypatch.setattr(framereader, "_decoder_pool", None)
+
+  barrier = threading.Barrier(8)
+  pools = []
+  def get_pool():
+    barrier.wait()
+    pools.append(framereader.decoder_pool())
+
+  threads = [threading.Thread(target=get_pool) for _ in range(8)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  assert len({id(pool) for pool in pools}) == 1
+  pools[0].shutdown()
+
+
+def test_gop_cache_round_trip(tmp_path):
+  content_key = "a" * 64
+  frames = [np.full((4, 8, 8, 3), i, dtype=np.uint8) for i in range(3)]
+  cache = framereader.GOPCache(str(tmp_path), max_size=2 * frames[0].nbytes + frames[0].nbytes // 2)
+
+  assert cache.get(content_key, 0, "rgb24") is None
+  cache.put(content_key, 0, "rgb24", frames[0])
+  time.sleep(0.01)
+  cache.put(content_key, 20, "rgb24", frames[1])
+  time.sleep(0.01)
+  np.testing.assert_array_equal(cache.get(content_key, 0, "rgb24"), frames[0])
+  assert cache.get(content_key, 0, "yuv420p") is None
+
+  # the GOP that was read is kept, the least recently used one is evicted
+  time.sleep(0.01)
+  cache.put(content_key, 40, "rgb24", frames[2])
+  np.testing.assert_array_equal(cache.get(content_key, 0, "rgb24"), frames[0])
+  assert cache.get(content_key, 20, "rgb24") is None
+  np.testing.assert_array_equal(cache.get(content_key, 40, "rgb24"), frames[2])
+
+  # a new index picks up the GOPs already on disk
+  os.remove(os.path.join(cache.root, "index.db"))
+  index = framereader.GOPCache(str(tmp_path)).index
+  with index._conn() as conn:
+    assert {name for name, in conn.execute("SELECT name FROM chunks")} == set(os.listdir(cache.root)) - {"index.db"}
+
+
+class FakeGOPFrameReader(framereader.GOPFrameReader):
+  # GOPs of 20 frames, each frame filled with its number
+  frame_count = 100
+  gop_size = 20
+
+  def __init__(self):
+    super().__init__()
+    self.decoded = []
+
+  def get_gop_start(self, num):
+    return num - num % self.gop_size
+
+  def _decode_gop(self, num, pix_fmt):
+    frame_b = self.get_gop_start(num)
+    self.decoded.append(frame_b)
+    return frame_b, np.arange(frame_b, frame_b + self.gop_size, dtype=np.uint8)[:, None].repeat(6, axis=1)
+
+
+def test_get_many():
+  fr = FakeGOPFrameReader()
+  nums = [55, 3, 99, 3, 41, 40, 0]
+  frames = fr.get_many(nums)
+  assert frames.shape == (len(nums), 6)
+  np.testing.assert_array_equal(frames[:, 0], nums)
+  assert sorted(fr.decoded) == [0, 40, 80]
+
+  # cached frames aren't decoded again
+  np.testing.assert_array_equal(fr.get(40, count=2)[1], np.full(6, 41))
+  np.testing.assert_array_equal(fr.get_many([99, 0])[:, 0], [99, 0])
+  assert sorted(fr.decoded) == [0, 40, 80]
+
+  assert fr.get_many([]).shape == (0,)
+  with pytest.raises(ValueError):
+    fr.get_many([100])
+
+
+@pytest.mark.parametrize("gop_cache", [False, True])
+def test_content_key_only_for_gop_cache(tmp_path, monkeypatch, gop_cache):
+  fn = str(tmp_path / "video.hevc")
+  with open(fn, "wb") as f:
+    f.write(encode_gop("yuv420p", num_frames=40, keyint=20))
+  frame_types, dat_len, prefix = framereader.hevc_index(fn)
+  index_data = {
+    'index': np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32),
+    'global_prefix': prefix,
+    'probe': {'streams': [{'width': W, 'height': H}]},
+  }
+
+  content_keys = []
+  video_content_key = framereader.video_content_key
+  def content_key(fn):
+    content_keys.append(fn)
+    return video_content_key(fn)
+  monkeypatch.setattr(framereader, "video_content_key", content_key)
+  monkeypatch.setenv("FRAMEREADER_GOP_CACHE", "1" if gop_cache else "0")
+
+  fr = framereader.FrameReader(fn, cache_dir=str(tmp_path / "cache"), index_data=index_data)
+  frames = fr.get_many([0, 25, 39], pix_fmt="rgb24")
+  assert frames.shape == (3, H, W, 3)
+  assert content_keys == ([fn] if gop_cache else [])
+
+  if gop_cache:
+    cached = framereader.FrameReader(fn, cache_dir=str(tmp_path / "cache"), index_data=index_data)
+    monkeypatch.setattr(framereader, "decompress_video_data", None)
+    np.testing.assert_array_equal(cached.get_many([0, 25, 39], pix_fmt="rgb24"), frames)
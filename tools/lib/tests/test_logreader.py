@@ -0,0 +1,242 @@
+import bz2
+import os
+import time
+
+import numpy as np
+import pytest
+
+from cereal import car, log
+from openpilot.tools.lib import logreader
+from openpilot.tools.lib.logreader import LogReader
+
+NUM_EVENTS = 50
+
+
+def write_log(path, seed=0):
+  rng = np.random.default_rng(seed)
+  events = []
+  for i in range(NUM_EVENTS):
+    # a bit out of order, like the logs written by loggerd
+    mono_time = int(1e9 + i * 1e7 + rng.integers(0, 2e7))
+    if i % 2 == 0:
+      msg = log.Event.new_message(logMonoTime=mono_time, valid=True)
+      msg.init("carState")
+      msg.carState.vEgo = float(rng.uniform(0, 30))
+      msg.carState.standstill = bool(i % 4 == 0)
+      msg.carState.gearShifter = car.CarState.GearShifter.drive if i % 3 else car.CarState.GearShifter.park
+    elif i % 3 == 0:
+      msg = log.Event.new_message(logMonoTime=mono_time, valid=True)
+      msg.init("controlsState")
+      msg.controlsState.init("lateralControlState").init("torqueState").output = float(rng.uniform(-1, 1))
+    else:
+      msg = log.Event.new_message(logMonoTime=mono_time, valid=True)
+      msg.init("deviceState").cpuTempC = [float(rng.uniform(30, 60))]
+    events.append(msg.to_bytes())
+
+  dat = b"".join(events)
+  with open(path, "wb") as f:
+    f.write(bz2.compress(dat) if str(path).endswith(".bz2") else dat)
+  return str(path)
+
+
+@pytest.fixture(params=["rlog", "rlog.bz2"])
+def log_path(tmp_path, request):
+  return write_log(tmp_path / request.param)
+
+
+def as_bytes(msgs):
+  return [m.as_builder().to_bytes() for m in msgs]
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("msg_types", [None, ["carState"], ["carState", "controlsState"], ["carControl"]])
+def test_select(log_path, msg_types, streaming):
+  msgs = list(LogReader(log_path))
+  assert len(msgs) == NUM_EVENTS
+
+  lr = LogReader(log_path, streaming=streaming)
+  expected = [m for m in msgs if msg_types is None or m.which() in msg_types]
+  assert as_bytes(lr.select(msg_types)) == as_bytes(expected)
+
+  t0, t1 = msgs[10].logMonoTime, msgs[30].logMonoTime
+  expected = [m for m in expected if t0 <= m.logMonoTime < t1]
+  assert as_bytes(lr.select(msg_types, start_time=t0, end_time=t1)) == as_bytes(expected)
+
+
+def test_filter(log_path):
+  msgs = list(LogReader(log_path))
+  lr = LogReader(log_path)
+  for msg_type in ("carState", "controlsState", "carControl"):
+    expected = [getattr(m, msg_type).as_builder().to_bytes() for m in msgs if m.which() == msg_type]
+    assert [m.as_builder().to_bytes() for m in lr.filter(msg_type)] == expected
+    assert (lr.first(msg_type) is None) == (len(expected) == 0)
+
+
+def test_sort_by_time(log_path):
+  msgs = sorted(LogReader(log_path), key=lambda m: m.logMonoTime)
+  assert as_bytes(LogReader(log_path, sort_by_time=True)) == as_bytes(msgs)
+  assert as_bytes(LogReader(log_path, sort_by_time=True).select(["carState"])) == as_bytes(m for m in msgs if m.which() == "carState")
+
+
+def test_iteration_without_index(log_path):
+  lr = logreader._LogFileReader(log_path)
+  msgs = as_bytes(lr)
+  assert lr._index is None
+
+  assert as_bytes(lr.select(["carState"])) == as_bytes(m for m in LogReader(log_path) if m.which() == "carState")
+  assert lr._index is not None
+  assert as_bytes(lr) == msgs
+
+
+def test_event_index_cache(log_path, tmp_path, monkeypatch):
+  cache_dir = str(tmp_path / "cache")
+  index_path = logreader.event_index_path(log_path, cache_dir)
+
+  expected = as_bytes(LogReader(log_path, cache=False, cache_dir=cache_dir))
+  assert not os.path.exists(index_path)
+
+  assert as_bytes(LogReader(log_path, cache=True, cache_dir=cache_dir)) == expected
+  assert os.path.exists(index_path)
+
+  # the cached index is used as is
+  with monkeypatch.context() as m:
+    m.setattr(logreader, "build_event_index", None)
+    assert as_bytes(LogReader(log_path, cache=True, cache_dir=cache_dir)) == expected
+
+  # a different log at the same path is indexed again, even when it has the same length
+  write_log(log_path, seed=1)
+  msgs = as_bytes(LogReader(log_path, cache=True, cache_dir=cache_dir))
+  assert msgs != expected
+  assert msgs == as_bytes(LogReader(log_path, cache=False))
+
+
+SERVICES = {"carState": ["vEgo", "standstill", "gearShifter"], "controlsState": ["lateralControlState.torqueState.output"]}
+
+
+def expected_columns(fn):
+  msgs = sorted((m for m in LogReader(fn) if m.which() in SERVICES), key=lambda m: m.logMonoTime)
+  carstates = [m for m in msgs if m.which() == "carState"]
+  controls = [m for m in msgs if m.which() == "controlsState"]
+  return {
+    "carState": {
+      "logMonoTime": [m.logMonoTime for m in carstates],
+      "vEgo": [m.carState.vEgo for m in carstates],
+      "standstill": [m.carState.standstill for m in carstates],
+      "gearShifter": [m.carState.gearShifter.raw for m in carstates],
+    },
+    "controlsState": {
+      "logMonoTime": [m.logMonoTime for m in controls],
+      "lateralControlState.torqueState.output": [m.controlsState.lateralControlState.torqueState.output for m in controls],
+    },
+  }
+
+
+def check_columns(cols, expected):
+  assert cols.keys() == expected.keys()
+  for service, fields in expected.items():
+    assert cols[service].keys() == fields.keys()
+    for field, values in fields.items():
+      assert cols[service][field].dtype != object
+      np.testing.assert_array_equal(cols[service][field], np.array(values, dtype=cols[service][field].dtype))
+
+
+def test_to_columns(log_path):
+  cols = LogReader(log_path).to_columns(SERVICES)
+  check_columns(cols, expected_columns(log_path))
+  assert cols["carState"]["logMonoTime"].dtype == np.uint64
+  assert cols["carState"]["vEgo"].dtype == np.float32
+  assert cols["carState"]["standstill"].dtype == np.bool_
+  assert cols["carState"]["gearShifter"].dtype == np.uint16
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+@pytest.mark.parametrize("cache", [False, True])
+def test_to_columns_segments(tmp_path, cache, prefetch):
+  fns = [write_log(tmp_path / f"rlog{i}", seed=i) for i in range(3)]
+  lr = LogReader(fns, prefetch=prefetch)
+  cols = lr.to_columns(SERVICES, cache=cache, cache_dir=str(tmp_path / "cache"))
+  assert lr._LogReader__lrs == {}
+
+  segments = [expected_columns(fn) for fn in fns]
+  check_columns(cols, {service: {field: sum((seg[service][field] for seg in segments), []) for field in fields}
+                       for service, fields in segments[0].items()})
+
+
+def test_to_columns_cache_round_trip(log_path, tmp_path):
+  cache_dir = str(tmp_path / "cache")
+  expected = expected_columns(log_path)
+  uncached = LogReader(log_path).to_columns(SERVICES)
+
+  check_columns(LogReader(log_path).to_columns({"carState": ["vEgo"]}, cache=True, cache_dir=cache_dir),
+                {"carState": {k: expected["carState"][k] for k in ("logMonoTime", "vEgo")}})
+  for _ in range(2):
+    cols = LogReader(log_path).to_columns(SERVICES, cache=True, cache_dir=cache_dir)
+    check_columns(cols, expected)
+    for service, fields in uncached.items():
+      for field, values in fields.items():
+        assert cols[service][field].dtype == values.dtype
+
+
+def test_to_columns_cache_invalidated(log_path, tmp_path):
+  cache_dir = str(tmp_path / "cache")
+  LogReader(log_path).to_columns(SERVICES, cache=True, cache_dir=cache_dir)
+
+  # same path and length, different contents
+  st = os.stat(log_path)
+  write_log(log_path, seed=1)
+  os.utime(log_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+  check_columns(LogReader(log_path).to_columns(SERVICES, cache=True, cache_dir=cache_dir), expected_columns(log_path))
+
+
+def test_to_columns_empty(log_path, tmp_path):
+  for cache in (False, True):
+    cols = LogReader(log_path).to_columns({"carControl": ["enabled"], "radarState": ["leadOne.dRel"]}, cache=cache, cache_dir=str(tmp_path))
+    assert cols["carControl"]["logMonoTime"].dtype == np.uint64
+    assert cols["carControl"]["enabled"].dtype == np.bool_
+    assert cols["radarState"]["leadOne.dRel"].dtype == np.float32
+    assert all(len(v) == 0 for fields in cols.values() for v in fields.values())
+
+
+@pytest.mark.parametrize("field", ["buttonEvents", "cruiseState"])
+def test_to_columns_non_scalar(log_path, field):
+  with pytest.raises(ValueError):
+    LogReader(log_path).to_columns({"carState": [field]})
+
+
+@pytest.mark.parametrize("rlogs_uploaded", [False, True])
+def test_auto_strategy_checks_files_once(monkeypatch, rlogs_uploaded):
+  rlogs = [f"https://example.com/{i}/rlog.bz2" for i in range(4)]
+  qlogs = [f"https://example.com/{i}/qlog.bz2" for i in range(4)]
+
+  checked = []
+  def files_exist(fns):
+    checked.append(fns)
+    return [rlogs_uploaded or "qlog" in fn for fn in fns]
+  monkeypatch.setattr(logreader, "files_exist", files_exist)
+  monkeypatch.setattr(logreader, "file_exists", None)
+
+  assert logreader.apply_strategy(logreader.ReadMode.AUTO, rlogs, qlogs) == (rlogs if rlogs_uploaded else qlogs)
+  assert checked == [rlogs + qlogs]
+
+
+@pytest.mark.parametrize("prefetch", [1, 3])
+def test_prefetch(tmp_path, prefetch):
+  fns = [write_log(tmp_path / f"rlog{i}", seed=i) for i in range(6)]
+  lr = LogReader(fns, prefetch=prefetch)
+
+  submitted = []
+  load_lr = lr._load_lr
+  def load(i):
+    submitted.append(i)
+    return load_lr(i)
+  lr._load_lr = load
+
+  msgs = []
+  for i, segment in enumerate(lr._iter_lrs()):
+    # the segment being read and the ones loaded ahead of it. the previous segment is still referenced
+    # while the next ones are submitted, so that's prefetch + 1 segments in memory at most
+    time.sleep(0.01)
+    assert len(submitted) - i <= prefetch
+    msgs += as_bytes(segment)
+  assert sorted(submitted) == list(range(6))
+  assert msgs == [m for fn in fns for m in as_bytes(LogReader(fn))]
@@ -1,7 +1,11 @@
 import logging
 import os
+import re
 import socket
+import sqlite3
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import sha256
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
@@ -12,9 +16,17 @@ from openpilot.system.hardware.hw import Paths
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+#  Number of chunks downloaded ahead of sequential readers
+READAHEAD_CHUNKS = int(os.environ.get("URLFILE_READAHEAD", "4"))
+MAX_DOWNLOAD_WORKERS = int(os.environ.get("URLFILE_WORKERS", "8"))
+#  Least recently used chunks are removed once the cache grows past this size
+DOWNLOAD_CACHE_MAX_SIZE = int(os.environ.get("DOWNLOAD_CACHE_MAX_SIZE", str(20 * 1000 * 1000 * K)))
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+# hash_256 of the url and the chunk index, see URLFile._chunk_path
+CHUNK_NAME = re.compile(r"^[0-9a-f]{64}_\d+\.\d+$")
+
 def hash_256(link: str) -> str:
   hsh = str(sha256((link.split("?")[0]).encode('utf-8')).hexdigest())
   return hsh
@@ -24,12 +36,126 @@ class URLFileException(Exception):
   pass
 
 
+class ChunkCacheIndex:
+  """
+  Tracks size and last access of every chunk in the download cache, so the least recently used ones can be evicted.
+
+  The index is shared between processes through sqlite. The cache size is kept as a running total that is only
+  checked against the database once it crosses the limit, since other processes add chunks too.
+  """
+  def __init__(self, root: str, max_size: int = DOWNLOAD_CACHE_MAX_SIZE, name_pattern: re.Pattern = CHUNK_NAME):
+    self.root = root
+    self.max_size = max_size
+    self.name_pattern = name_pattern
+    self.path = os.path.join(root, "index.db")
+    self.total = 0
+    self._conn_file: tuple[int, int] | None = None
+    self._connection: sqlite3.Connection | None = None
+    self._lock = threading.Lock()
+
+  def _conn(self) -> sqlite3.Connection:
+    # the cache dir can be removed under us (e.g. OpenpilotPrefix), reopen and rebuild the index then
+    try:
+      st = os.stat(self.path)
+      conn_file = (st.st_dev, st.st_ino)
+    except FileNotFoundError:
+      conn_file = None
+
+    if self._connection is None or conn_file is None or conn_file != self._conn_file:
+      if self._connection is not None:
+        self._connection.close()
+      os.makedirs(self.root, exist_ok=True)
+      # shared between processes, sqlite handles the locking
+      self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+      with self._connection as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS chunks (name TEXT PRIMARY KEY, size INTEGER, atime REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS chunks_atime ON chunks (atime)")
+        if conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0] == 0:
+          self._backfill(conn)
+        self.total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM chunks").fetchone()[0]
+      st = os.stat(self.path)
+      self._conn_file = (st.st_dev, st.st_ino)
+    return self._connection
+
+  def _backfill(self, conn: sqlite3.Connection) -> None:
+    # chunks downloaded before the index existed, or by a version without it
+    chunks = []
+    with os.scandir(self.root) as entries:
+      for entry in entries:
+        if self.name_pattern.match(entry.name):
+          try:
+            st = entry.stat()
+          except FileNotFoundError:
+            continue
+          chunks.append((entry.name, st.st_size, st.st_mtime))
+    conn.executemany("INSERT OR IGNORE INTO chunks (name, size, atime) VALUES (?, ?, ?)", chunks)
+
+  def touch(self, chunks: list[tuple[str, int]]) -> None:
+    """Marks the (name, size) chunks as used, adding the ones the index doesn't know yet."""
+    now = time.time()
+    with self._lock, self._conn() as conn:
+      conn.executemany("INSERT INTO chunks (name, size, atime) VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET atime = excluded.atime",
+                       [(name, size, now) for name, size in chunks])
+
+  def add(self, name: str, size: int) -> None:
+    with self._lock, self._conn() as conn:
+      conn.execute("INSERT OR REPLACE INTO chunks (name, size, atime) VALUES (?, ?, ?)", (name, size, time.time()))
+      self.total += size
+      if self.total > self.max_size:
+        self.total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM chunks").fetchone()[0]
+        if self.total > self.max_size:
+          self.total -= self._evict(conn, self.total - int(0.9 * self.max_size))
+
+  def _evict(self, conn: sqlite3.Connection, to_free: int) -> int:
+    evicted = []
+    freed = 0
+    for name, size in conn.execute("SELECT name, size FROM chunks ORDER BY atime"):
+      if freed >= to_free:
+        break
+      try:
+        os.remove(os.path.join(self.root, name))
+      except FileNotFoundError:
+        pass
+      evicted.append((name,))
+      freed += size
+    conn.executemany("DELETE FROM chunks WHERE name = ?", evicted)
+    return freed
+
+
 class URLFile:
   _pool_manager: PoolManager|None = None
+  _executor: ThreadPoolExecutor|None = None
+  _chunk_cache: ChunkCacheIndex|None = None
+  _inflight: dict[str, Future] = {}
+  _inflight_lock = threading.Lock()
 
   @staticmethod
   def reset() -> None:
+    if URLFile._executor is not None:
+      # queued downloads still finish, the worker threads exit after that
+      URLFile._executor.shutdown(wait=False)
+    URLFile._reset_after_fork()
+
+  @staticmethod
+  def _reset_after_fork() -> None:
+    # the parent's worker threads don't exist in a forked child, and its executor's lock may be held, so it's only dropped
     URLFile._pool_manager = None
+    URLFile._executor = None
+    URLFile._chunk_cache = None
+    URLFile._inflight = {}
+    URLFile._inflight_lock = threading.Lock()
+
+  @staticmethod
+  def executor() -> ThreadPoolExecutor:
+    if URLFile._executor is None:
+      URLFile._executor = ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS, thread_name_prefix="urlfile")
+    return URLFile._executor
+
+  @staticmethod
+  def chunk_cache() -> ChunkCacheIndex:
+    if URLFile._chunk_cache is None or URLFile._chunk_cache.root != Paths.download_cache_root():
+      URLFile._chunk_cache = ChunkCacheIndex(Paths.download_cache_root())
+    return URLFile._chunk_cache
 
   @staticmethod
   def pool_manager() -> PoolManager:
@@ -43,6 +169,7 @@ class URLFile:
     self._url = url
     self._timeout = Timeout(connect=timeout, read=timeout)
     self._pos = 0
+    self._last_read_end = 0
     self._length: int|None = None
     self._debug = debug
     #  True by default, false if FILEREADER_CACHE is defined, but can be overwritten by the cache input
@@ -86,49 +213,87 @@ class URLFile:
         file_length.write(str(self._length))
     return self._length
 
+  def _chunk_path(self, position: int) -> str:
+    return os.path.join(Paths.download_cache_root(), hash_256(self._url) + "_" + str(position / CHUNK_SIZE))
+
+  def _download_chunk(self, position: int, path: str) -> bytes:
+    data = self._fetch(position, CHUNK_SIZE)
+    with atomic_write_in_dir(path, mode="wb", overwrite=True) as new_cached_file:
+      new_cached_file.write(data)
+    URLFile.chunk_cache().add(os.path.basename(path), len(data))
+    return data
+
+  def _schedule_chunk(self, position: int) -> Future|None:
+    #  Starts downloading a chunk unless it's cached or already being downloaded, by this or any other URLFile
+    path = self._chunk_path(position)
+    with URLFile._inflight_lock:
+      future = URLFile._inflight.get(path)
+      if future is None and not os.path.exists(path):
+        future = URLFile.executor().submit(self._download_chunk, position, path)
+        URLFile._inflight[path] = future
+        future.add_done_callback(lambda _: URLFile._inflight.pop(path, None))
+    return future
+
   def read(self, ll: int|None=None) -> bytes:
     if self._force_download:
       return self.read_aux(ll=ll)
 
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    length = self.get_length()
+    assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    file_end = min(self._pos + ll, length) if ll is not None else length
+    if file_begin >= file_end:
+      return b""
     #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
+    positions = range((file_begin // CHUNK_SIZE) * CHUNK_SIZE, file_end, CHUNK_SIZE)
+    downloads = {position: self._schedule_chunk(position) for position in positions}
+
+    #  Sequential readers get the next chunks downloaded in the background
+    if file_begin == self._last_read_end:
+      for position in range(positions[-1] + CHUNK_SIZE, min(positions[-1] + (READAHEAD_CHUNKS + 1) * CHUNK_SIZE, length), CHUNK_SIZE):
+        self._schedule_chunk(position)
+
+    response = bytearray()
+    cached = []
+    for position in positions:
+      path = self._chunk_path(position)
+      download = downloads[position]
+      if download is not None:
+        data = download.result()
       else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
+        try:
+          with open(path, "rb") as cached_file:
+            data = cached_file.read()
+          cached.append((os.path.basename(path), len(data)))
+        except FileNotFoundError:
+          #  Evicted between scheduling and reading
+          data = self._download_chunk(position, path)
 
       response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+    if len(cached):
+      URLFile.chunk_cache().touch(cached)
+
+    self._pos = file_end
+    self._last_read_end = file_end
+    return bytes(response)
 
   def read_aux(self, ll: int|None=None) -> bytes:
+    ret = self._fetch(self._pos, ll)
+    self._pos += len(ret)
+    return ret
+
+  def _fetch(self, pos: int, ll: int|None=None) -> bytes:
     download_range = False
     headers = {}
-    if self._pos != 0 or ll is not None:
+    if pos != 0 or ll is not None:
       if ll is None:
         end = self.get_length() - 1
       else:
-        end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
+        end = min(pos + ll, self.get_length()) - 1
+      if pos > end:
         return b""
-      headers['Range'] = f"bytes={self._pos}-{end}"
+      headers['Range'] = f"bytes={pos}-{end}"
       download_range = True
 
     if self._debug:
@@ -150,7 +315,6 @@ class URLFile:
     if (not download_range) and response_code != 200:  # OK
       raise URLFileException(f"Error {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
 
-    self._pos += len(ret)
     return ret
 
   def seek(self, pos:int) -> None:
@@ -161,4 +325,4 @@ class URLFile:
     return self._url
 
 
-os.register_at_fork(after_in_child=URLFile.reset)
+os.register_at_fork(after_in_child=URLFile._reset_after_fork)